@@ -1,3 +1,4 @@
 from .version import __version__
 
-from .bot import PoGORaidBot
\ No newline at end of file
+from .bot import PoGORaidBot
+from .worker import OCRWorker
\ No newline at end of file
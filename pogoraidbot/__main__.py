@@ -3,13 +3,16 @@ import argparse
 import logging
 import os
 
-from pogoraidbot import PoGORaidBot
+from pogoraidbot import PoGORaidBot, OCRWorker
 from .log import logger_setup
 
 if __name__ == "__main__":
     # Gets inline arguments
     parser = argparse.ArgumentParser(prog="pogoraidbot")
 
+    parser.add_argument("mode", nargs="?", choices=("bot", "worker"), default="bot",
+                        help="Run the bot or a worker that analyzes the screenshots queued by the bots")
+
     parser.add_argument("-t", "--token", dest="token", help="telegram bot token")
     parser.add_argument("-r", "--redis", dest="redis", help="redis url in \"redis://{host}[:port]/{db}\" format")
     parser.add_argument("-a", "--superadmin", dest="superadmin", help="superadmin's id")
@@ -21,6 +24,29 @@ if __name__ == "__main__":
                         help="JSON file contains gyms and their coordinates. It can be also provided over http(s)")
     parser.add_argument("-y", "--gyms-expiration", dest="gyms_expiration",
                         help="Validity of the gyms list in hours")
+    parser.add_argument("-m", "--admins-expiration", dest="admins_expiration",
+                        help="Validity of the cached administrators of a chat in minutes")
+    parser.add_argument("-u", "--update-window", dest="update_window",
+                        help="Minimum seconds between two updates of the message of a raid")
+    parser.add_argument("-c", "--cache-folder", dest="cache_folder",
+                        help="Folder where the local copies of the remote files and the snapshots of the lists are kept")
+    parser.add_argument("-k", "--archive-folder", dest="archive_folder",
+                        help="Folder where the history of the ended raids is archived")
+    parser.add_argument("-w", "--webhook-url", dest="webhook_url",
+                        help="Public https url of the webhook, served by a single instance. "
+                             "If it isn't provided the updates are polled")
+    parser.add_argument("--webhook-listen", dest="webhook_listen", help="Address where the webhook listens")
+    parser.add_argument("--webhook-port", dest="webhook_port", help="Port where the webhook listens")
+    parser.add_argument("--webhook-secret", dest="webhook_secret",
+                        help="Secret path of the webhook, it is derived from the token if it isn't provided")
+    parser.add_argument("-n", "--workers", dest="workers", help="Number of threads that handle the updates")
+    parser.add_argument("-s", "--async", dest="async_mode", action="store_const", const=True,
+                        help="Download the screenshots with asyncio, so the downloads don't hold any thread "
+                             "(Redis and the Bot API are still called from threads)")
+    parser.add_argument("--ocr-workers", dest="ocr_workers",
+                        help="Number of threads that analyze the screenshots in asyncio mode")
+    parser.add_argument("--remote-ocr", dest="remote_ocr", action="store_const", const=True,
+                        help="Queue the screenshots for the workers instead of analyzing them")
     parser.add_argument("-e", "--env", dest="env", action="store_true",
                         help="Use environment variables for the configuration")
     parser.add_argument("-d", "--debug-folder", dest="debug_folder", help="debug folder")
@@ -44,9 +70,25 @@ if __name__ == "__main__":
             "gyms_expiration": os.getenv("PGRB_BOT_GYMS_EXPIRATION"),
             "bosses_file": os.getenv("PGRB_BOT_BOSSES_FILE"),
             "bosses_expiration": os.getenv("PGRB_BOT_BOSSES_EXPIRATION"),
+            "admins_expiration": os.getenv("PGRB_BOT_ADMINS_EXPIRATION"),
+            "update_window": os.getenv("PGRB_BOT_UPDATE_WINDOW"),
+            "cache_folder": os.getenv("PGRB_BOT_CACHE_PATH"),
+            "archive_folder": os.getenv("PGRB_BOT_ARCHIVE_PATH"),
+            "webhook_url": os.getenv("PGRB_BOT_WEBHOOK_URL"),
+            "webhook_listen": os.getenv("PGRB_BOT_WEBHOOK_LISTEN"),
+            "webhook_port": os.getenv("PGRB_BOT_WEBHOOK_PORT"),
+            "webhook_secret": os.getenv("PGRB_BOT_WEBHOOK_SECRET"),
+            "workers": os.getenv("PGRB_BOT_WORKERS"),
+            "ocr_workers": os.getenv("PGRB_BOT_OCR_WORKERS"),
             "log_level": os.getenv("PGRB_BOT_LOG_LEVEL")
         }
 
+        if os.getenv("PGRB_BOT_ASYNC") is not None:
+            env["async_mode"] = True
+
+        if os.getenv("PGRB_BOT_REMOTE_OCR") is not None:
+            env["remote_ocr"] = True
+
         if os.getenv("PGRB_BOT_DEBUG_PATH") is not None:
             env["debug_folder"] = "/srv"
 
@@ -76,8 +118,19 @@ if __name__ == "__main__":
     if "log_level" in args:
         del args["log_level"]
 
-    # Creates the bot
-    bot = PoGORaidBot(**args)
+    mode = args.pop("mode")
+
+    if mode == "worker":
+        # Creates the worker with its own options
+        worker = OCRWorker(**{k: args[k] for k in ("token", "redis", "bosses_file", "bosses_expiration",
+                                                   "gyms_file", "gyms_expiration", "cache_folder") if k in args})
+
+        # Analyzes the queued screenshots
+        worker.run()
+
+    else:
+        # Creates the bot
+        bot = PoGORaidBot(**args)
 
-    # Manages updates
-    bot.listen()
+        # Manages updates
+        bot.listen()
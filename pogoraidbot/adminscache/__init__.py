@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, FrozenSet
+
+from telegram import Bot, error
+
+_LOGGER = logging.getLogger(__package__)
+
+# Minimal age in seconds of an entry before a failed check refreshes it,
+# so a new administrator doesn't wait the whole expiration
+_MIN_AGE = 60
+
+
+@dataclass
+class _Entry:
+    admins: FrozenSet[int]
+    updated: float
+    used: float
+
+
+class AdminsCache:
+    """Cache of the administrators of the chats, it avoids to ask them to Telegram for every check"""
+
+    def __init__(self, bot: Bot, expiration: int):
+        self._bot = bot
+        # Seconds of validity of an entry
+        self._expiration = expiration
+
+        self._lock = threading.Lock()
+        self._entries: Dict[int, _Entry] = {}
+
+    def is_admin(self, chat_id: int, user_id: int) -> bool:
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(chat_id)
+
+        if entry is None or now - entry.updated > self._expiration:
+            entry = self._update(chat_id)
+        elif user_id not in entry.admins and now - entry.updated > _MIN_AGE:
+            _LOGGER.debug("User {} is not a cached admin of {}, refresh the administrators".format(user_id, chat_id))
+            entry = self._update(chat_id)
+
+        entry.used = now
+
+        return user_id in entry.admins
+
+    def invalidate(self, chat_id: int) -> None:
+        with self._lock:
+            if self._entries.pop(chat_id, None) is not None:
+                _LOGGER.debug("Administrators of {} are invalidated".format(chat_id))
+
+    def refresh(self) -> None:
+        """Updates in background the entries close to the expiration and removes the unused ones"""
+        now = time.monotonic()
+
+        with self._lock:
+            entries = list(self._entries.items())
+
+        for chat_id, entry in entries:
+            if now - entry.used > self._expiration:
+                self.invalidate(chat_id)
+
+            elif now - entry.updated > self._expiration / 2:
+                try:
+                    self._update(chat_id, entry.used)
+                except error.TelegramError:
+                    _LOGGER.warning("Unable to refresh the administrators of {}".format(chat_id))
+
+    def _update(self, chat_id: int, used: float = None) -> _Entry:
+        admins = frozenset(a.user.id for a in self._bot.get_chat_administrators(chat_id))
+        now = time.monotonic()
+
+        entry = _Entry(admins, now, used if used is not None else now)
+
+        with self._lock:
+            self._entries[chat_id] = entry
+
+        _LOGGER.debug("Administrators of {} are updated".format(chat_id))
+
+        return entry
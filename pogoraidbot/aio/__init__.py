@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+
+from ..metrics import metrics
+
+_LOGGER = logging.getLogger(__package__)
+
+API_URL = "https://api.telegram.org/bot{}/{}"
+FILE_URL = "https://api.telegram.org/file/bot{}/{}"
+
+# Connections kept open towards Telegram
+CONNECTIONS = 100
+
+# Seconds to wait a download
+DOWNLOAD_TIMEOUT = 30
+
+
+class DownloadError(Exception):
+    pass
+
+
+class AsyncRunner:
+    """Event loop in a background thread that runs the handling of the screenshots as coroutines
+
+    Only the downloads of the screenshots are asynchronous: their waits on the network don't hold
+    any thread and they share a pool of connections. The CPU bound work runs in a small executor,
+    while the work with the blocking clients (Redis and Bot) is handed over to the executor of the chat.
+    """
+
+    def __init__(self, token: str, cpu_workers: int):
+        self._token = token
+        self._cpu = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="aio-cpu")
+
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="aio", daemon=True).start()
+
+        self._session = self.submit(self._open()).result()
+
+    async def _open(self) -> aiohttp.ClientSession:
+        # The session must be created inside the loop
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=CONNECTIONS),
+                                     timeout=aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT))
+
+    def submit(self, coro: Awaitable[Any]) -> Future:
+        """Schedules the coroutine from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def spawn(self, coro: Awaitable[Any]) -> None:
+        """Schedules the coroutine without waiting for it, its errors are logged"""
+        with self._lock:
+            self._in_flight += 1
+            metrics.set("aio.in_flight", self._in_flight)
+
+        def done(future: Future) -> None:
+            with self._lock:
+                self._in_flight -= 1
+                metrics.set("aio.in_flight", self._in_flight)
+
+            if future.exception() is not None:
+                _LOGGER.error("An update is failed", exc_info=future.exception())
+
+        self.submit(coro).add_done_callback(done)
+
+    async def run_cpu(self, func: Callable[..., Any], *args) -> Any:
+        return await self._loop.run_in_executor(self._cpu, func, *args)
+
+    async def download(self, file_id: str) -> bytearray:
+        """Downloads a file sent to the bot
+
+        The URLs contain the token of the bot, so the errors never report them.
+        """
+        try:
+            async with self._session.get(API_URL.format(self._token, "getFile"), params={"file_id": file_id}) as r:
+                if r.status != 200 or r.content_type != "application/json":
+                    raise DownloadError("getFile replied HTTP status {} ({})".format(r.status, r.content_type))
+
+                data = await r.json()
+
+            if not data.get("ok"):
+                raise DownloadError(data.get("description"))
+
+            async with self._session.get(FILE_URL.format(self._token, data["result"]["file_path"])) as r:
+                if r.status != 200:
+                    raise DownloadError("HTTP status {}".format(r.status))
+
+                return bytearray(await r.read())
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise DownloadError("Unable to download the file: {}".format(type(e).__name__)) from None
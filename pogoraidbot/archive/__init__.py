@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import datetime
+import functools
+import glob
+import logging
+import marshal
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterator, List, Tuple, Union
+
+from ..raid import Raid
+
+_LOGGER = logging.getLogger(__package__)
+
+# Raids kept in memory before they are written as a block
+BLOCK_SIZE = 1024
+
+# Header of a block: magic, number of raids, length of the compressed data, first and last end
+_BLOCK_HEADER = struct.Struct("<4sIIdd")
+_BLOCK_MAGIC = b"PGRA"
+
+# Columns of a block
+_COLUMNS = ("ended_at", "chat_id", "gym", "boss", "level", "participants", "is_ex")
+
+# Possible groupings of the raids
+GROUPS = ("gym", "boss", "level", "day", "week")
+
+
+class InvalidGroup(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=4096)
+def _period(by: str, hour: int) -> str:
+    """Returns the day or the week of an hour from the epoch, the raids of the same hour share it"""
+    date = datetime.date.fromtimestamp(hour * 3600)
+    if by == "day":
+        return date.isoformat()
+    return "{}-W{:02d}".format(*date.isocalendar()[:2])
+
+
+class Archive:
+    """Append only history of the ended raids
+
+    The raids are collected in memory and written in blocks of columns, encoded with marshal
+    and compressed with zlib, at the end of a monthly segment file (raids-YYYY-MM.seg).
+    Every block begins with the interval of the ends of its raids, so the queries skip
+    without decompressing the segments and the blocks outside of their time window.
+    """
+
+    def __init__(self, folder: str):
+        self._folder = os.path.abspath(folder)
+        os.makedirs(self._folder, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._buffer: List[tuple] = []
+
+    def append(self, raid: Raid, ended_at: float = None) -> None:
+        row = (ended_at if ended_at is not None else time.time(),
+               raid.chat_id,
+               raid.gym.name if raid.gym is not None else "",
+               raid.boss.name if raid.boss is not None else "",
+               raid.effective_level or 0,
+               raid.participants_count,
+               raid.is_ex)
+
+        with self._lock:
+            self._buffer.append(row)
+            if len(self._buffer) < BLOCK_SIZE:
+                return
+            rows, self._buffer = self._buffer, []
+
+        self._write(rows)
+
+    def flush(self) -> None:
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+
+        if len(rows) > 0:
+            self._write(rows)
+
+    def _segment(self, ended_at: float) -> str:
+        return os.path.join(self._folder, datetime.datetime.fromtimestamp(ended_at).strftime("raids-%Y-%m.seg"))
+
+    def _write(self, rows: List[tuple]) -> None:
+        # A block never crosses two segments
+        segments = defaultdict(list)
+        for r in rows:
+            segments[self._segment(r[0])].append(r)
+
+        for path, rows in segments.items():
+            rows.sort(key=lambda r: r[0])
+
+            data = zlib.compress(marshal.dumps([list(c) for c in zip(*rows)]))
+            header = _BLOCK_HEADER.pack(_BLOCK_MAGIC, len(rows), len(data), rows[0][0], rows[-1][0])
+
+            try:
+                # A single write, so the blocks of more processes don't interleave
+                with open(path, "ab") as f:
+                    f.write(header + data)
+            except OSError:
+                _LOGGER.exception("Unable to write {} raids in the archive".format(len(rows)))
+                continue
+
+            _LOGGER.debug("{} raids are archived in {}".format(len(rows), path))
+
+    def _blocks(self, since: float, until: float) -> Iterator[Dict[str, list]]:
+        """Yields the columns of the blocks that could contain raids ended in the time window"""
+        first = datetime.datetime.fromtimestamp(since).strftime("raids-%Y-%m.seg")
+        last = datetime.datetime.fromtimestamp(until).strftime("raids-%Y-%m.seg")
+
+        for path in sorted(glob.glob(os.path.join(self._folder, "raids-*.seg"))):
+            if not first <= os.path.basename(path) <= last:
+                continue
+
+            with open(path, "rb") as f:
+                while True:
+                    header = f.read(_BLOCK_HEADER.size)
+                    if len(header) < _BLOCK_HEADER.size:
+                        break
+
+                    magic, _, length, begin, end = _BLOCK_HEADER.unpack(header)
+                    if magic != _BLOCK_MAGIC:
+                        _LOGGER.warning("The archive {} is corrupted".format(path))
+                        break
+
+                    if end < since or begin > until:
+                        f.seek(length, os.SEEK_CUR)
+                        continue
+
+                    try:
+                        yield dict(zip(_COLUMNS, marshal.loads(zlib.decompress(f.read(length)))))
+                    except (zlib.error, ValueError, EOFError):
+                        _LOGGER.warning("The archive {} has a truncated block".format(path))
+                        break
+
+    def aggregate(self, by: str, since: float, until: float = None,
+                  chat_id: int = None) -> List[Tuple[Union[str, int], int, int]]:
+        """Returns (group, raids, participants) of the raids ended in the time window, the busiest first"""
+        if by not in GROUPS:
+            raise InvalidGroup
+
+        # The raids in memory are written, so they are counted too
+        self.flush()
+
+        until = until if until is not None else time.time()
+
+        raids = defaultdict(int)
+        participants = defaultdict(int)
+
+        for block in self._blocks(since, until):
+            if by in ("day", "week"):
+                keys = [_period(by, int(t // 3600)) for t in block["ended_at"]]
+            else:
+                keys = block[by]
+
+            for t, c, k, p in zip(block["ended_at"], block["chat_id"], keys, block["participants"]):
+                if t < since or t > until or (chat_id is not None and c != chat_id):
+                    continue
+
+                raids[k] += 1
+                participants[k] += p
+
+        return sorted(((k, raids[k], participants[k]) for k in raids), key=lambda x: (-x[1], -x[2]))
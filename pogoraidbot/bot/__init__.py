@@ -1,29 +1,89 @@
 from __future__ import annotations
 
+import asyncio
 import datetime
 import functools
+import hashlib
+import json
 import logging
 import os
-import pickle
 import re
 import sys
+import threading
+import time
 import traceback
-from typing import Callable
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Tuple, Union
 
 import cv2
 from apscheduler.schedulers.background import BackgroundScheduler
 from redis import StrictRedis, exceptions
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, Update, Bot, Message, error
+from redis.client import Pipeline
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, Update, Bot, Message, User, error
 from telegram.ext import Updater, MessageHandler, CallbackQueryHandler, CommandHandler, CallbackContext
 from telegram.ext.filters import Filters
 
 from .. import redis_keys
-from ..data import bosses, gyms
+from ..adminscache import AdminsCache
+from ..aio import AsyncRunner
+from ..archive import Archive, GROUPS, InvalidGroup
+from ..chatexecutor import ChatExecutor
+from ..configcache import ConfigCache
+from ..debouncer import Debouncer
+from ..data import add_reload_job, bosses, gyms
+from ..mediagroup import MediaGroupCollector
+from ..metrics import metrics
+from ..ocrqueue import StreamConsumer, RESULTS_GROUP, push
+from ..outbox import Outbox, Priority
 from ..raid import Raid
+from ..raid import codec
+from ..raid.codec import InvalidRaid
+from ..raidstore import RaidStore, RaidNotFound, END, REMIND
 from ..screenshot import ScreenshotRaid
 
 _LOGGER = logging.getLogger(__package__)
 
+# Seconds of validity of a raid whose end is unknown
+RAID_EXPIRATION = 60 * 60 * 6
+
+# Seconds a raid is kept after its end
+RAID_GRACE = 60 * 5
+
+# Seconds before the hangout when the participants are reminded
+REMINDER_ADVANCE = 60 * 10
+
+# Seconds of difference between the ends of two screenshots of the same raid
+DUPLICATE_TOLERANCE = 60 * 3
+
+# Short notice shown at once to the user that taps a button of a raid, the result isn't known yet
+BUTTONS_TOAST = "\U0001F44D Received"
+
+# Seconds to wait the other screenshots of an album
+ALBUM_WINDOW = 1.5
+
+# Number of screenshots of an album that are downloaded at the same time
+ALBUM_DOWNLOADS = 4
+
+# Seconds between two checks of the due events of the raids
+SCHEDULE_INTERVAL = 5
+
+# Maximum number of due events taken at every check
+SCHEDULE_BATCH = 10
+
+# Seconds between two writes of the ended raids in the archive
+ARCHIVE_INTERVAL = 60
+
+# Days of the raids in the statistics if they aren't specified
+STATS_DAYS = 7
+
+# Number of messages whose content is remembered to skip the edits that change nothing
+DIGESTS_SIZE = 4096
+
+# Minutes between two logs of the metrics
+METRICS_INTERVAL = 15
+
+
 class PoGORaidBot:
     class Decorator:
         class ChatMustBeEnabled:
@@ -41,7 +101,7 @@ class PoGORaidBot:
                     chat_id = update.callback_query.message.chat_id
 
                 # Check if this chat is enabled
-                if not inst._redis.sismember(redis_keys.ENABLEDCHAT, chat_id):
+                if not inst._config.is_member(redis_keys.ENABLEDCHAT, chat_id):
                     _LOGGER.info("Chat {} is not enabled".format(chat_id))
 
                     return False
@@ -62,12 +122,8 @@ class PoGORaidBot:
                 if update.message.chat.type == update.message.chat.PRIVATE:
                     is_admin = True
                 else:
-                    # Get the list of administrators of a chat
-                    for a in context.bot.get_chat_administrators(update.message.chat.id):
-                        # Check if the current admin in the user
-                        if a.user.id == update.message.from_user.id:
-                            is_admin = True
-                            break
+                    # Check if the user is in the cached list of administrators of the chat
+                    is_admin = inst._admins.is_admin(update.message.chat.id, update.message.from_user.id)
 
                 # Check if the sender is an admin
                 if not is_admin:
@@ -87,7 +143,7 @@ class PoGORaidBot:
 
             def __call__(self, inst: PoGORaidBot, update: Update, context: CallbackContext) -> bool:
                 # Check if the user is a bot admin
-                if not inst._redis.sismember(redis_keys.ADMIN, update.message.from_user.id):
+                if not inst._config.is_member(redis_keys.ADMIN, update.message.from_user.id):
                     _LOGGER.warning("User {} is not a bot admin".format(update.message.from_user.id))
 
                     return False
@@ -102,6 +158,18 @@ class PoGORaidBot:
                  bosses_expiration: int = 12,
                  gyms_file: str = None,
                  gyms_expiration: int = 12,
+                 admins_expiration: int = 10,
+                 update_window: float = 3,
+                 cache_folder: str = None,
+                 archive_folder: str = None,
+                 webhook_url: str = None,
+                 webhook_listen: str = "0.0.0.0",
+                 webhook_port: int = 8443,
+                 webhook_secret: str = None,
+                 workers: int = 4,
+                 async_mode: bool = False,
+                 remote_ocr: bool = False,
+                 ocr_workers: int = 2,
                  debug_folder: str = None
                  ):
         # Init and test redis connection
@@ -115,12 +183,20 @@ class PoGORaidBot:
             sys.exit()
         _LOGGER.info("Successfully connected to Redis")
 
+        # Init the storage of the raids
+        self._raids = RaidStore(self._redis, RAID_EXPIRATION, RAID_GRACE, REMINDER_ADVANCE)
+
+        self._init_db()
+
+        # Init the cache of the configuration
+        self._config = ConfigCache(self._redis)
+
         # Save superadmin
         self._superadmin = int(superadmin) if superadmin is not None else None
         # Add superadmin to the admins db
         if self._superadmin is not None:
             self._redis.set(redis_keys.SUPERADMIN, self._superadmin)
-            self._redis.sadd(redis_keys.ADMIN, self._superadmin)
+            self._config.add(redis_keys.ADMIN, self._superadmin)
 
         # Save debug folder
         self._debug_folder = debug_folder
@@ -129,44 +205,108 @@ class PoGORaidBot:
             ScreenshotRaid.debug = True
             _LOGGER.info("\"{}\" was set as debug folder".format(self._debug_folder))
 
+        # Init the archive of the ended raids
+        self._archive = None
+        if archive_folder is not None:
+            self._archive = Archive(archive_folder)
+            _LOGGER.info("\"{}\" was set as archive folder".format(os.path.abspath(archive_folder)))
+
+        # Init the digests of the messages of the raids
+        self._digests: OrderedDict = OrderedDict()
+        self._digests_lock = threading.Lock()
+
+        # Init the coalescing of the updates of the messages
+        self._debouncer = Debouncer(float(update_window))
+
         # Init the bot
         self._bot = Bot(token)
 
+        # Init the scheduler of the requests to Telegram
+        self._outbox = Outbox()
+
+        # Init the consumer of the raids found by the OCR workers, it is started when the bot is ready
+        self._remote_ocr = bool(remote_ocr)
+        self._ocr_results = None
+        if self._remote_ocr:
+            self._ocr_results = StreamConsumer(self._redis, redis_keys.OCR_RESULTS, RESULTS_GROUP,
+                                               self._handle_ocr_result)
+            _LOGGER.info("The screenshots are analyzed by the workers")
+
+        # Init the collector of the albums of screenshots
+        self._albums = MediaGroupCollector(ALBUM_WINDOW, lambda messages: self._executor.submit(
+            messages[0].chat.id, self._scan_album, messages))
+        self._downloads = ThreadPoolExecutor(max_workers=ALBUM_DOWNLOADS, thread_name_prefix="download")
+
+        # Init the event loop of the asyncio mode
+        self._aio = None
+        if async_mode:
+            self._aio = AsyncRunner(token, int(ocr_workers))
+            _LOGGER.info("The screenshots are handled in asyncio mode")
+
         # Init updater
         self._updater = Updater(bot=self._bot, use_context=True)
 
+        # Init the executor of the updates, the updates of a chat are handled in order
+        self._executor = ChatExecutor(int(workers))
+
+        # Save the webhook configuration, the secret path is derived from the token if it isn't provided
+        self._webhook_url = webhook_url.rstrip("/") if webhook_url is not None else None
+        self._webhook_listen = webhook_listen
+        self._webhook_port = int(webhook_port)
+        self._webhook_secret = webhook_secret if webhook_secret is not None else \
+            hashlib.sha256(token.encode()).hexdigest()[:32]
+
         # Get the id of the bot
         self._id = self._bot.get_me().id
 
+        # Init the cache of the chats' administrators
+        self._admins = AdminsCache(self._bot, int(admins_expiration) * 60)
+
         # Set the handler functions
         # Set the handler for screens
-        self._updater.dispatcher.add_handler(MessageHandler(Filters.photo, self._handler_screenshot))
+        self._updater.dispatcher.add_handler(MessageHandler(Filters.photo, self._in_order(self._handler_screenshot)))
         # Set the handler to set the hangout
         self._updater.dispatcher.add_handler(MessageHandler(
-            Filters.reply & Filters.regex(r"^\s*[0-2]?[0-9][:.,][0-5]?[0-9]\s*$"), self._handler_set_hangout))
+            Filters.reply & Filters.regex(r"^\s*[0-2]?[0-9][:.,][0-5]?[0-9]\s*$"),
+            self._in_order(self._handler_set_hangout)))
         # Set the handler for the buttons
         self._updater.dispatcher.add_handler(CallbackQueryHandler(self._handler_buttons))
         # Set the handler for the pinned message notify
         self._updater.dispatcher.add_handler(MessageHandler(Filters.status_update.pinned_message,
-                                                            self._handler_event_pinned))
+                                                            self._in_order(self._handler_event_pinned)))
+        # Set the handler for the members changes
+        self._updater.dispatcher.add_handler(MessageHandler(
+            Filters.status_update.new_chat_members | Filters.status_update.left_chat_member,
+            self._in_order(self._handler_event_members)))
         # Set the handler to set the boss
         self._updater.dispatcher.add_handler(MessageHandler(
-            Filters.reply & Filters.regex(r"^\s*[a-zA-Z]+\s*$"), self._handler_set_boss))
+            Filters.reply & Filters.regex(r"^\s*[a-zA-Z]+\s*$"), self._in_order(self._handler_set_boss)))
 
+        # Set the handler for raids command
+        self._updater.dispatcher.add_handler(CommandHandler("raids", self._in_order(self._handler_command_raids)))
+        # Set the handler for stats command
+        if self._archive is not None:
+            self._updater.dispatcher.add_handler(CommandHandler("stats", self._in_order(self._handler_command_stats)))
         # Set the handler for scan command
-        self._updater.dispatcher.add_handler(CommandHandler("scan", self._handler_command_scan))
+        self._updater.dispatcher.add_handler(CommandHandler("scan", self._in_order(self._handler_command_scan)))
         # Set the handler for enablechat command
-        self._updater.dispatcher.add_handler(CommandHandler("enablechat", self._handler_command_enablechat))
+        self._updater.dispatcher.add_handler(CommandHandler("enablechat",
+                                                            self._in_order(self._handler_command_enablechat)))
         # Set the handler for disablechat command
-        self._updater.dispatcher.add_handler(CommandHandler("disablechat", self._handler_command_disablechat))
+        self._updater.dispatcher.add_handler(CommandHandler("disablechat",
+                                                            self._in_order(self._handler_command_disablechat)))
         # Set the handler for enablescan command
-        self._updater.dispatcher.add_handler(CommandHandler("enablescan", self._handler_command_enablescan))
+        self._updater.dispatcher.add_handler(CommandHandler("enablescan",
+                                                            self._in_order(self._handler_command_enablescan)))
         # Set the handler for disablescan command
-        self._updater.dispatcher.add_handler(CommandHandler("disablescan", self._handler_command_disablescan))
+        self._updater.dispatcher.add_handler(CommandHandler("disablescan",
+                                                            self._in_order(self._handler_command_disablescan)))
         # Set the handler for addadmin command
-        self._updater.dispatcher.add_handler(CommandHandler("addadmin", self._handler_command_addadmin, Filters.reply))
+        self._updater.dispatcher.add_handler(CommandHandler("addadmin", self._in_order(self._handler_command_addadmin),
+                                                            Filters.reply))
         # Set the handler for removeadmin command
-        self._updater.dispatcher.add_handler(CommandHandler("removeadmin", self._handler_command_removeadmin,
+        self._updater.dispatcher.add_handler(CommandHandler("removeadmin",
+                                                            self._in_order(self._handler_command_removeadmin),
                                                             Filters.reply))
 
         # Set the handler for the errors
@@ -175,15 +315,36 @@ class PoGORaidBot:
         # Creates background scheduler for update the db
         self._scheduler = BackgroundScheduler(daemon=True)
 
+        # Save cache folder
+        self._cache_folder = cache_folder
+        if self._cache_folder is not None:
+            self._cache_folder = os.path.abspath(cache_folder)
+            _LOGGER.info("\"{}\" was set as cache folder".format(self._cache_folder))
+
         # Creates job to update bosses list
         if bosses_file is not None:
-            bosses.load_from(bosses_file)
-            self._scheduler.add_job(lambda: bosses.load_from(bosses_file), 'interval', hours=int(bosses_expiration))
+            bosses.load_from(bosses_file, self._cache_folder)
+            add_reload_job(self._scheduler, lambda: bosses.load_from(bosses_file, self._cache_folder),
+                           bosses_file, bosses_expiration)
 
         # Creates job to update gyms list
         if gyms_file is not None:
-            gyms.load_from(gyms_file)
-            self._scheduler.add_job(lambda: gyms.load_from(gyms_file), 'interval', hours=int(gyms_expiration))
+            gyms.load_from(gyms_file, self._cache_folder)
+            add_reload_job(self._scheduler, lambda: gyms.load_from(gyms_file, self._cache_folder),
+                           gyms_file, gyms_expiration)
+
+        # Creates job to keep updated the cache of the chats' administrators
+        self._scheduler.add_job(self._admins.refresh, 'interval', seconds=int(admins_expiration) * 60 // 4)
+
+        # Creates job to handle the ends and the reminders of the raids
+        self._scheduler.add_job(self._handle_due_events, 'interval', seconds=SCHEDULE_INTERVAL)
+
+        # Creates job to write the ended raids in the archive
+        if self._archive is not None:
+            self._scheduler.add_job(self._archive.flush, 'interval', seconds=ARCHIVE_INTERVAL)
+
+        # Creates job to log the metrics
+        self._scheduler.add_job(metrics.log, 'interval', minutes=METRICS_INTERVAL)
 
         # Starts the scheduler
         self._scheduler.start()
@@ -193,22 +354,53 @@ class PoGORaidBot:
     def listen(self) -> None:
         _LOGGER.info("Start listening")
 
+        # Begin to post the raids found by the OCR workers, also the ones left while the bot was down
+        if self._ocr_results is not None:
+            self._ocr_results.start()
+
         # Begin to listen
-        self._updater.start_polling()
+        if self._webhook_url is not None:
+            # Telegram pushes the updates to the secret path, the requests to any other path are refused
+            # A single process must serve the webhook, the outbox and the chat executor keep the rate limits
+            # and the order of the chats in memory
+            self._updater.start_webhook(listen=self._webhook_listen,
+                                        port=self._webhook_port,
+                                        url_path=self._webhook_secret,
+                                        webhook_url="{}/{}".format(self._webhook_url, self._webhook_secret))
+            _LOGGER.info("Webhook listening on {}:{}".format(self._webhook_listen, self._webhook_port))
+        else:
+            self._updater.start_polling()
         # Wait
         self._updater.idle()
 
+        # Writes the raids that are still in memory
+        if self._archive is not None:
+            self._archive.flush()
+
+    def _in_order(self, handler: Callable[[Update, CallbackContext], bool]) -> Callable[..., None]:
+        """Runs the handler in the executor, after the previous updates of the same chat"""
+        return self._executor.wrap(handler, lambda update, _: update.effective_chat.id)
+
     def _handler_error(self, update: Update, context: CallbackContext) -> None:
         _LOGGER.warning('Update "{}" caused error "{}"'.format(update, context.error))
 
     @Decorator.ChatMustBeEnabled
     def _handler_event_pinned(self, update: Update, _: CallbackContext) -> bool:
+        # Keep track of the pinned message, so it isn't required to ask it to Telegram
+        self._set_pinned(update.message.chat.id, update.message.pinned_message.message_id)
+
         # Check if the pin is caused by the bot
         if update.message.from_user.id != self._id:
             return False
 
         # Remove the notify message
-        self._bot.delete_message(update.message.chat.id, update.message.message_id)
+        self._try_to_delete(update.message)
+
+        return True
+
+    def _handler_event_members(self, update: Update, _: CallbackContext) -> bool:
+        # A member that joins or leaves could change the administrators
+        self._admins.invalidate(update.message.chat.id)
 
         return True
 
@@ -218,10 +410,15 @@ class PoGORaidBot:
                           .format(update.effective_chat.title, update.effective_user.username))
 
         # Check if scan is disabled for this group
-        if self._redis.exists(update.effective_chat.id):
+        if self._config.is_member(redis_keys.DISABLEDSCAN, update.effective_chat.id):
             _LOGGER.info("Screenshots scan for chat {} is disabled".format(update.effective_chat.id))
             return False
 
+        # The screenshots of an album are collected and scanned together
+        if update.message.media_group_id is not None:
+            self._albums.add(update.message)
+            return True
+
         # Scan the screenshot
         self._scan_screenshot(update.message)
         return True
@@ -235,69 +432,74 @@ class PoGORaidBot:
         try:
             # Search the code in the bot message
             code = re.search(r"\[([a-zA-Z0-9]{8})\]", update.message.reply_to_message.text).group(1)
-            # Try to retrieve the raid information
-            raid = pickle.loads(self._redis.get(redis_keys.RAID.format(code)))
         except Exception:  # TODO: improve except
-            traceback.print_exc()
             _LOGGER.warning("A invalid to bot message reply was come")
             return False
 
-        _LOGGER.info("A reply to bot message was come")
-
         # Find the new hangout
         result = re.search(r"([0-2]?[0-9])[:.,]([0-5]?[0-9])", update.message.text)
-        # Set new hangout
-        raid.hangout = datetime.time(int(result.group(1)), int(result.group(2)))
 
-        _LOGGER.debug(raid)
+        try:
+            # Set new hangout
+            raid = self._raids.set_hangout(code, datetime.time(int(result.group(1)), int(result.group(2))))
+        except (RaidNotFound, InvalidRaid, ValueError):
+            _LOGGER.warning("A invalid to bot message reply was come")
+            return False
 
-        # Save the raid in the db
-        self._redis.setex(redis_keys.RAID.format(raid.code), 60 * 60 * 6, pickle.dumps(raid))
+        _LOGGER.info("A reply to bot message was come")
+
+        _LOGGER.debug(raid)
 
         # Try to delete user message
         self._try_to_delete(update.message)
 
         # Updates the message
-        self._post_raid(raid, update.message.reply_to_message)
+        self._update_raid(raid, update.message.reply_to_message)
 
         return True
 
     @Decorator.ChatMustBeEnabled
     def _handler_buttons(self, update: Update, _: CallbackContext) -> bool:
+        query = update.callback_query
+
         try:
             # Validate the data
-            result = re.match(r"([a-zA-Z0-9]{8}):([arhf])", update.callback_query.data)
-            # Try to retrieve the raid information
-            raid = pickle.loads(self._redis.get(redis_keys.RAID.format(result.group(1))))
+            result = re.match(r"([a-zA-Z0-9]{8}):([arhf])", query.data)
+            code = result.group(1)
             # Get operation
             op = result.group(2)
         except Exception:  # TODO: improve except
             _LOGGER.warning("A invalid callback query was come")
+            self._outbox.submit(Priority.CALLBACK, None, query.answer)
             return False
 
-        _LOGGER.info("A callback query was come")
+        # Acknowledges the tap at once, so the user doesn't tap again while the raid is updated
+        # The notice doesn't tell the result, it is shown by the updated message
+        self._outbox.submit(Priority.CALLBACK, None, query.answer, BUTTONS_TOAST)
 
-        # Edit list of participants
-        if op == "a":
-            raid.add_participant(update.callback_query.from_user)
-        elif op == "r":
-            raid.remove_participant(update.callback_query.from_user)
-        elif op == "h":
-            raid.toggle_remote(update.callback_query.from_user)
-        elif op == "f":
-            raid.toggle_flyer(update.callback_query.from_user)
-        else:
-            return False
+        # Updates the raid after the previous updates of the chat
+        self._executor.submit(query.message.chat.id, self._change_participant, code, op, query.from_user,
+                              query.message)
 
-        _LOGGER.debug(raid)
+        return True
 
-        # Save the raid in the db
-        self._redis.setex(redis_keys.RAID.format(raid.code), 60 * 60 * 6, pickle.dumps(raid))
+    def _change_participant(self, code: str, op: str, user: User, message: Message) -> None:
+        try:
+            # Edit list of participants
+            changed, raid = self._raids.update_participant(code, user.id, user.full_name, op)
+        except (RaidNotFound, InvalidRaid):
+            _LOGGER.warning("A callback query for an unknown raid was come")
+            return
 
-        # Updates the message
-        self._post_raid(raid, update.callback_query.message)
+        _LOGGER.info("A callback query was come")
 
-        return True
+        _LOGGER.debug(raid)
+
+        # Updates the message only if something is changed, at most once in the update window
+        if changed:
+            self._debouncer.call(code,
+                                 functools.partial(self._update_raid, raid, message),
+                                 functools.partial(self._executor.submit, message.chat.id, self._refresh_raid, code))
 
     @Decorator.ChatMustBeEnabled
     def _handler_set_boss(self, update: Update, _: CallbackContext) -> bool:
@@ -308,18 +510,10 @@ class PoGORaidBot:
         try:
             # Search the code in the bot message
             code = re.search(r"\[([a-zA-Z0-9]{8})\]", update.message.reply_to_message.text).group(1)
-            # Try to retrieve the raid information
-            raid = pickle.loads(self._redis.get(redis_keys.RAID.format(code)))
         except Exception:  # TODO: improve except
             _LOGGER.warning("A invalid to bot message reply was come")
             return False
 
-        _LOGGER.info("A request to change boss was come from {}({}) by {}({})"
-                          .format(update.effective_chat.title, update.effective_chat.id,
-                                  update.effective_user.username, update.effective_user.id))
-
-        _LOGGER.info("The user suggested \"{}\"".format(update.message.text.strip()))
-
         # Get the suggested boss name
         name = update.message.text.strip()
 
@@ -328,17 +522,22 @@ class PoGORaidBot:
 
         # If the boss wasn't found reply with an error
         if b is None:
-            update.message.reply_markdown("Sorry, but i don't know *{}*".format(name))
-            _LOGGER.info("A valid boss wasn't found")
+            self._reply(update.message, "Sorry, but i don't know *{}*".format(name))
+            _LOGGER.info("A valid boss for \"{}\" wasn't found".format(name))
             return False
 
-        _LOGGER.info("\"{}\" was found".format(b.name))
+        try:
+            # Set the new boss
+            raid = self._raids.set_boss(code, b)
+        except (RaidNotFound, InvalidRaid):
+            _LOGGER.warning("A invalid to bot message reply was come")
+            return False
 
-        # Set the new boss
-        raid.boss = b
+        _LOGGER.info("A request to change boss was come from {}({}) by {}({})"
+                          .format(update.effective_chat.title, update.effective_chat.id,
+                                  update.effective_user.username, update.effective_user.id))
 
-        # Save the raid in the db
-        self._redis.setex(redis_keys.RAID.format(raid.code), 60 * 60 * 6, pickle.dumps(raid))
+        _LOGGER.info("The user suggested \"{}\", \"{}\" was found".format(name, b.name))
 
         _LOGGER.debug(raid)
 
@@ -346,7 +545,7 @@ class PoGORaidBot:
         self._try_to_delete(update.message)
 
         # Updates the message
-        self._post_raid(raid, update.message.reply_to_message)
+        self._update_raid(raid, update.message.reply_to_message)
 
         return True
 
@@ -354,10 +553,10 @@ class PoGORaidBot:
     @Decorator.UserMustBeAdmin
     def _handler_command_disablescan(self, update: Update, _: CallbackContext) -> bool:
         # Add current chat to the db of disabled scan
-        self._redis.sadd(redis_keys.DISABLEDSCAN, update.message.chat.id)
+        self._config.add(redis_keys.DISABLEDSCAN, update.message.chat.id)
 
         _LOGGER.info("Disable scan for chat {}".format(update.message.chat.id))
-        update.message.chat.send_message("The scan now is disabled")
+        self._reply(update.message, "The scan now is disabled", markdown=False, quote=False)
 
         return True
 
@@ -365,10 +564,10 @@ class PoGORaidBot:
     @Decorator.UserMustBeAdmin
     def _handler_command_enablescan(self, update: Update, _: CallbackContext) -> bool:
         # Remove current chat from the db of disabled scan
-        self._redis.srem(redis_keys.DISABLEDSCAN, update.message.chat.id)
+        self._config.remove(redis_keys.DISABLEDSCAN, update.message.chat.id)
 
         _LOGGER.info("Enable scan for chat {}".format(update.message.chat.id))
-        update.message.chat.send_message("The scan now is enabled")
+        self._reply(update.message, "The scan now is enabled", markdown=False, quote=False)
 
         return True
 
@@ -378,7 +577,7 @@ class PoGORaidBot:
 
         # Check if it is a reply to screenshot
         if update.message.reply_to_message is None or len(update.message.reply_to_message.photo) == 0:
-            update.message.reply_text("It must be a reply to a screenshot")
+            self._reply(update.message, "It must be a reply to a screenshot", markdown=False)
             _LOGGER.info("Invalid scan command")
             return False
 
@@ -394,25 +593,78 @@ class PoGORaidBot:
 
         return True
 
+    @Decorator.ChatMustBeEnabled
+    def _handler_command_raids(self, update: Update, _: CallbackContext) -> bool:
+        _LOGGER.info("Required the active raids of {} by {}".format(update.message.chat.id,
+                                                                   update.message.from_user.id))
+
+        raids = self._raids.active(update.message.chat.id)
+
+        if len(raids) == 0:
+            self._reply(update.message, "There aren't active raids")
+            return True
+
+        lines = ["*Active raids*", ""]
+        for raid in raids:
+            line = "`{}` {}".format(raid.end.strftime("%H:%M") if raid.end is not None else "--:--",
+                                    raid.gym.name if raid.gym is not None else "Unknown gym")
+            if raid.boss is not None:
+                line += " *{}*".format(raid.boss.name)
+            elif raid.effective_level is not None:
+                line += " " + "\U00002B50" * raid.effective_level
+            if raid.participants_count > 0:
+                line += " ({})".format(raid.participants_count)
+            lines.append(line)
+
+        self._reply(update.message, "\n".join(lines), disable_web_page_preview=True)
+
+        return True
+
+    @Decorator.ChatMustBeEnabled
+    def _handler_command_stats(self, update: Update, context: CallbackContext) -> bool:
+        _LOGGER.info("Required the stats of {} by {}".format(update.message.chat.id, update.message.from_user.id))
+
+        # Parses the optional grouping and days
+        try:
+            by = context.args[0].lower() if len(context.args) > 0 else "gym"
+            days = int(context.args[1]) if len(context.args) > 1 else STATS_DAYS
+
+            stats = self._archive.aggregate(by, time.time() - days * 24 * 60 * 60, chat_id=update.message.chat.id)
+        except (ValueError, InvalidGroup):
+            self._reply(update.message, "Usage: `/stats [{}] [days]`".format("|".join(GROUPS)))
+            return False
+
+        if len(stats) == 0:
+            self._reply(update.message, "There aren't raids in the last {} days".format(days))
+            return True
+
+        lines = ["*Raids by {} in the last {} days*".format(by, days), ""]
+        for group, raids, participants in stats[:10]:
+            lines.append("`{:>4}` raids `{:>5}` participants  {}".format(raids, participants, group or "Unknown"))
+
+        self._reply(update.message, "\n".join(lines), disable_web_page_preview=True)
+
+        return True
+
     @Decorator.UserMustBeBotAdmin
     def _handler_command_addadmin(self, update: Update, _: CallbackContext) -> bool:
         _LOGGER.info("User {} try to add {} as bot admin".format(update.message.from_user.id,
                                                                       update.message.reply_to_message.from_user.id))
 
         # Check if the cited user is already a bot admin
-        if self._redis.sismember(redis_keys.ADMIN, update.message.reply_to_message.from_user.id):
+        if self._config.is_member(redis_keys.ADMIN, update.message.reply_to_message.from_user.id):
             _LOGGER.info("User {} is already a bot admin".format(update.message.reply_to_message.from_user.id))
-            update.message.reply_markdown("[{}](tg://user?id={}) is already a bot admin"
-                                          .format(update.message.reply_to_message.from_user.username,
-                                                  update.message.reply_to_message.from_user.id))
+            self._reply(update.message, "[{}](tg://user?id={}) is already a bot admin"
+                                        .format(update.message.reply_to_message.from_user.username,
+                                                update.message.reply_to_message.from_user.id))
             return False
 
         # Add cited user as bot admin
-        self._redis.sadd(redis_keys.ADMIN, update.message.reply_to_message.from_user.id)
+        self._config.add(redis_keys.ADMIN, update.message.reply_to_message.from_user.id)
         _LOGGER.info("User {} is now a bot admin".format(update.message.reply_to_message.from_user.id))
-        update.message.reply_markdown("[{}](tg://user?id={}) is now a bot admin"
-                                      .format(update.message.reply_to_message.from_user.username,
-                                              update.message.reply_to_message.from_user.id))
+        self._reply(update.message, "[{}](tg://user?id={}) is now a bot admin"
+                                    .format(update.message.reply_to_message.from_user.username,
+                                            update.message.reply_to_message.from_user.id))
 
         return True
 
@@ -422,27 +674,27 @@ class PoGORaidBot:
                                                                          update.message.reply_to_message.from_user.id))
 
         # Check if the mentioned user is the superadmin
-        if self._redis.get(redis_keys.SUPERADMIN) == update.message.reply_to_message.from_user.id:
+        if int(self._redis.get(redis_keys.SUPERADMIN) or 0) == update.message.reply_to_message.from_user.id:
             _LOGGER.info("User {} is the superadmin".format(update.message.reply_to_message.from_user.id))
-            update.message.reply_markdown("[{}](tg://user?id={}) is the superadmin and it cannot be removed"
-                                          .format(update.message.reply_to_message.from_user.username,
-                                                  update.message.reply_to_message.from_user.id))
+            self._reply(update.message, "[{}](tg://user?id={}) is the superadmin and it cannot be removed"
+                                        .format(update.message.reply_to_message.from_user.username,
+                                                update.message.reply_to_message.from_user.id))
             return False
 
         # Check if the cited user is not a bot admin
-        if not self._redis.sismember(redis_keys.ADMIN, update.message.reply_to_message.from_user.id):
+        if not self._config.is_member(redis_keys.ADMIN, update.message.reply_to_message.from_user.id):
             _LOGGER.info("User {} is not a bot admin".format(update.message.reply_to_message.from_user.id))
-            update.message.reply_markdown("[{}](tg://user?id={}) is not a bot admin"
-                                          .format(update.message.reply_to_message.from_user.username,
-                                                  update.message.reply_to_message.from_user.id))
+            self._reply(update.message, "[{}](tg://user?id={}) is not a bot admin"
+                                        .format(update.message.reply_to_message.from_user.username,
+                                                update.message.reply_to_message.from_user.id))
             return False
 
         # Remove cited user as bot admin
-        self._redis.srem(redis_keys.ADMIN, update.message.reply_to_message.from_user.id)
+        self._config.remove(redis_keys.ADMIN, update.message.reply_to_message.from_user.id)
         _LOGGER.info("User {} is no longer a bot admin".format(update.message.reply_to_message.from_user.id))
-        update.message.reply_markdown("[{}](tg://user?id={}) is no longer a bot admin"
-                                      .format(update.message.reply_to_message.from_user.username,
-                                              update.message.reply_to_message.from_user.id))
+        self._reply(update.message, "[{}](tg://user?id={}) is no longer a bot admin"
+                                    .format(update.message.reply_to_message.from_user.username,
+                                            update.message.reply_to_message.from_user.id))
 
         return True
 
@@ -452,15 +704,15 @@ class PoGORaidBot:
                                                                           update.message.chat.id))
 
         # Check if this chat is already enabled
-        if self._redis.sismember(redis_keys.ENABLEDCHAT, update.message.chat.id):
+        if self._config.is_member(redis_keys.ENABLEDCHAT, update.message.chat.id):
             _LOGGER.info("Chat {} is already enabled".format(update.message.chat.id))
-            update.message.reply_markdown("This chat is already enabled")
+            self._reply(update.message, "This chat is already enabled")
             return False
 
         # Add this chat to the enabled
-        self._redis.sadd(redis_keys.ENABLEDCHAT, update.message.chat.id)
+        self._config.add(redis_keys.ENABLEDCHAT, update.message.chat.id)
         _LOGGER.info("Chat {} is now enabled".format(update.message.chat.id))
-        update.message.reply_markdown("This chat is now enabled")
+        self._reply(update.message, "This chat is now enabled")
 
         return True
 
@@ -470,45 +722,152 @@ class PoGORaidBot:
                                                                            update.message.chat.id))
 
         # Check if this chat is not enabled
-        if not self._redis.sismember(redis_keys.ENABLEDCHAT, update.message.chat.id):
+        if not self._config.is_member(redis_keys.ENABLEDCHAT, update.message.chat.id):
             _LOGGER.info("Chat {} is not enabled".format(update.message.chat.id))
-            update.message.reply_markdown("This chat is not enabled")
+            self._reply(update.message, "This chat is not enabled")
             return False
 
         # Remove this chat to the enabled
-        self._redis.srem(redis_keys.ENABLEDCHAT, update.message.chat.id)
+        self._config.remove(redis_keys.ENABLEDCHAT, update.message.chat.id)
         _LOGGER.info("Chat {} is no longer enabled".format(update.message.chat.id))
-        update.message.reply_markdown("This chat is no longer enabled")
+        self._reply(update.message, "This chat is no longer enabled")
 
         return True
 
     def _scan_screenshot(self, message: Message) -> None:
+        # The screenshot is queued for the OCR workers
+        if self._remote_ocr:
+            push(self._redis, redis_keys.OCR_JOBS, {
+                "file_id": message.photo[-1].file_id,
+                "message": message.to_json()
+            })
+            return
+
+        # In asyncio mode the screenshot is handled by a coroutine, so no thread waits for it
+        if self._aio is not None:
+            self._aio.spawn(self._scan_screenshot_async(message))
+            return
+
         # Get the highest resolution image
         img = message.photo[-1].get_file().download_as_bytearray()
 
+        screen, raid = self._analyze(img)
+        if raid is not None:
+            self._publish(screen, raid, message)
+
+    def _scan_album(self, messages: List[Message]) -> None:
+        # The workers already analyze the screenshots in parallel
+        if self._remote_ocr:
+            for m in messages:
+                self._scan_screenshot(m)
+            return
+
+        if self._aio is not None:
+            self._aio.spawn(self._scan_album_async(messages))
+            return
+
+        # Downloads the screenshots at the same time
+        imgs = list(self._downloads.map(self._download, messages))
+
+        self._publish_album(self._analyze_album(imgs), messages)
+
+    async def _scan_album_async(self, messages: List[Message]) -> None:
+        imgs = await asyncio.gather(*(self._aio.download(m.photo[-1].file_id) for m in messages),
+                                    return_exceptions=True)
+        for i, m in zip(imgs, messages):
+            if isinstance(i, Exception):
+                _LOGGER.warning("Unable to download the screenshot {}: {}".format(m.message_id, i))
+        imgs = [i if not isinstance(i, Exception) else None for i in imgs]
+
+        results = await self._aio.run_cpu(self._analyze_album, imgs)
+
+        # The raids are posted after the previous updates of the chat
+        await asyncio.wrap_future(self._executor.submit(messages[0].chat.id, self._publish_album, results, messages))
+
+    @staticmethod
+    def _download(message: Message) -> Union[bytearray, None]:
+        # Get the highest resolution image
+        try:
+            return message.photo[-1].get_file().download_as_bytearray()
+        except error.TelegramError:
+            _LOGGER.warning("Unable to download the screenshot {}".format(message.message_id))
+            return None
+
+    @classmethod
+    def _analyze_album(cls, imgs: List[Union[bytearray, None]]) -> List[Tuple[ScreenshotRaid, Union[Raid, None]]]:
+        # The screenshots are analyzed by a single task, one after another
+        results = []
+        for i, img in enumerate(imgs):
+            if img is None:
+                results.append((None, None))
+                continue
+
+            # A screenshot that can't be analyzed doesn't stop the others
+            try:
+                results.append(cls._analyze(img))
+            except Exception:
+                _LOGGER.exception("Unable to analyze the screenshot {} of the album".format(i))
+                results.append((None, None))
+
+        return results
+
+    def _publish_album(self, results: List[Tuple[ScreenshotRaid, Union[Raid, None]]],
+                       messages: List[Message]) -> None:
+        # The raids are posted together, in the order of the album
+        for (screen, raid), message in zip(results, messages):
+            if raid is None:
+                continue
+
+            # A raid that isn't posted doesn't stop the others
+            try:
+                self._publish(screen, raid, message)
+            except Exception:
+                _LOGGER.exception("Unable to post the raid {}".format(raid.code))
+
+    async def _scan_screenshot_async(self, message: Message) -> None:
+        # Get the highest resolution image
+        img = await self._aio.download(message.photo[-1].file_id)
+
+        screen, raid = await self._aio.run_cpu(self._analyze, img)
+        if raid is not None:
+            # The raid is posted after the previous updates of the chat
+            await asyncio.wrap_future(self._executor.submit(message.chat.id, self._publish, screen, raid, message))
+
+    def _handle_ocr_result(self, result: dict, _: Pipeline) -> None:
+        raid = codec.decode(result[b"raid"])
+        message = Message.de_json(json.loads(result[b"message"]), self._bot)
+
+        # The raid is posted after the previous updates of the chat, the sections of the screenshot stay
+        # in the worker. If it isn't posted the result isn't acknowledged, so it is tried again
+        sent = self._executor.submit(message.chat.id, self._publish, None, raid, message).result()
+
+        # The consumer isn't a shard of the chats, so it can wait for the message to be sent
+        if sent is not None:
+            sent.result()
+
+    @staticmethod
+    def _analyze(img: bytearray) -> Tuple[ScreenshotRaid, Union[Raid, None]]:
         # Load the screenshot
         screen = ScreenshotRaid(img)
 
         # Check if it's a screenshot of a raid
         if not screen.is_raid:
-            return
+            return screen, None
 
         _LOGGER.info("It's a valid screen of a raid")
 
         # Get the raid dataclass
-        raid = screen.to_raid()
+        return screen, screen.to_raid()
 
-        # Save the raid in the db
-        self._redis.setex(redis_keys.RAID.format(raid.code), 60 * 60 * 6, pickle.dumps(raid))
+    def _publish(self, screen: Union[ScreenshotRaid, None], raid: Raid, message: Message) -> Union[Future, None]:
+        """Posts the raid or merges it in the same raid already posted, the failures are raised
 
-        # Send reply
-        try:
-            self._post_raid(raid, message)
-        except:
-            traceback.print_exc()  # TODO: Remove this debug method
+        Returns the future of the message of the raid, if the raid is posted
+        """
+        raid.chat_id = message.chat.id
 
         # Save sections of image if it is required
-        if self._debug_folder is not None:
+        if self._debug_folder is not None and screen is not None:
             try:
                 os.makedirs(self._debug_folder, exist_ok=True)
 
@@ -523,7 +882,133 @@ class PoGORaidBot:
             except PermissionError:
                 _LOGGER.warning("Unable to create debug folder")
 
-    def _post_raid(self, raid: Raid, message: Message) -> None:
+        # Save the raid in the db, unless the same raid was already posted in this chat
+        original = self._raids.save_unique(raid, DUPLICATE_TOLERANCE)
+
+        if original is None:
+            # Send reply
+            return self._post_raid(raid, message)
+
+        return self._merge_raid(original, raid, message)
+
+    def _merge_raid(self, original: Raid, raid: Raid, message: Message) -> Union[Future, None]:
+        _LOGGER.info("The raid is a duplicate of {}".format(original.code))
+
+        # Completes the original raid with this screenshot
+        if original.merge(raid):
+            try:
+                original = self._raids.set_merged(original)
+            except RaidNotFound:
+                # The original raid is ended in the meantime, so this is a new raid
+                self._raids.save(raid)
+                return self._post_raid(raid, message)
+
+            if original.message_id is not None:
+                self._edit_raid(original, original.chat_id, original.message_id)
+
+        # The original raid was never posted, e.g. its post is failed, so it is posted now
+        # unless another process is still posting it
+        if original.message_id is None:
+            if self._raids.claim_post(original.code):
+                return self._post_raid(original, message)
+
+            _LOGGER.info("The raid {} is being posted".format(original.code))
+            return None
+
+        # Replies to the message of the original raid, so the reply links to it
+        self._outbox.submit(Priority.SEND, message.chat.id, self._bot.send_message, message.chat.id,
+                            "This raid is already posted", reply_to_message_id=original.message_id)
+        return None
+
+    @staticmethod
+    def _markup(raid: Raid) -> Union[InlineKeyboardMarkup, None]:
+        # If the hangout is defined the message has the reply buttons
+        if raid.hangout is None:
+            return None
+
+        return InlineKeyboardMarkup([[
+            InlineKeyboardButton("\U00002795", callback_data=raid.code + ":a"),
+            InlineKeyboardButton("\U00002796", callback_data=raid.code + ":r"),
+            InlineKeyboardButton("\U0001F3E1", callback_data=raid.code + ":h"),
+            InlineKeyboardButton("\U00002708", callback_data=raid.code + ":f")
+        ]])
+
+    def _update_raid(self, raid: Raid, message: Message) -> None:
+        # The first time the hangout is set the raid is posted again, so it gets the buttons
+        if message.reply_markup is None and raid.hangout is not None:
+            self._post_raid(raid, message)
+            return
+
+        self._edit_raid(raid, message.chat.id, message.message_id)
+
+    def _refresh_raid(self, code: str) -> None:
+        # Reads the latest state of the raid
+        try:
+            raid = self._raids.get(code)
+        except (RaidNotFound, InvalidRaid):
+            return
+
+        if raid.message_id is not None:
+            self._edit_raid(raid, raid.chat_id, raid.message_id)
+
+    def _edit_raid(self, raid: Raid, chat_id: int, message_id: int) -> None:
+        text = raid.to_msg()
+        markup = self._markup(raid)
+        digest = self._digest(text, markup)
+
+        # Check if the message already shows the same text and buttons
+        with self._digests_lock:
+            if self._digests.get((chat_id, message_id)) == digest:
+                metrics.observe("bot.edits.skipped")
+                return
+
+        # The content is remembered at once, so the same edit isn't queued twice
+        self._remember(chat_id, message_id, digest)
+
+        self._then(self._outbox.submit(Priority.EDIT, chat_id, self._bot.edit_message_text, text, chat_id,
+                                       message_id, reply_markup=markup, disable_web_page_preview=True,
+                                       parse_mode=ParseMode.MARKDOWN),
+                   chat_id, self._edited, raid.code, chat_id, message_id, digest)
+
+    def _edited(self, future: Future, code: str, chat_id: int, message_id: int, digest: bytes) -> None:
+        e = future.exception()
+
+        # Another process could have already edited the message
+        if e is None or (isinstance(e, error.BadRequest) and "not modified" in str(e).lower()):
+            metrics.observe("bot.edits.sent")
+            return
+
+        # The message doesn't show the content, so the next edit is sent
+        self._forget(chat_id, message_id, digest)
+
+        if isinstance(e, error.BadRequest):
+            _LOGGER.info("The message of the raid {} is no longer available".format(code))
+        else:
+            _LOGGER.warning("Unable to edit the message of the raid {}: {}".format(code, e))
+
+    def _then(self, future: Future, chat_id: int, func: Callable, *args) -> None:
+        """Calls func with the completed future in the shard of the chat, so no shard waits for the outbox"""
+        future.add_done_callback(lambda f: self._executor.submit(chat_id, func, f, *args))
+
+    @staticmethod
+    def _digest(text: str, markup: Union[InlineKeyboardMarkup, None]) -> bytes:
+        return hashlib.sha1((text + (markup.to_json() if markup is not None else "")).encode()).digest()
+
+    def _remember(self, chat_id: int, message_id: int, digest: bytes) -> None:
+        """Keeps the digest of the content of a message of a raid"""
+        with self._digests_lock:
+            self._digests[(chat_id, message_id)] = digest
+            self._digests.move_to_end((chat_id, message_id))
+            if len(self._digests) > DIGESTS_SIZE:
+                self._digests.popitem(last=False)
+
+    def _forget(self, chat_id: int, message_id: int, digest: bytes) -> None:
+        """Forgets the digest of a message, unless a newer content is remembered"""
+        with self._digests_lock:
+            if self._digests.get((chat_id, message_id)) == digest:
+                del self._digests[(chat_id, message_id)]
+
+    def _post_raid(self, raid: Raid, message: Message) -> Future:
         options = {
             "disable_web_page_preview": True,
             "parse_mode": ParseMode.MARKDOWN
@@ -531,23 +1016,14 @@ class PoGORaidBot:
 
         # If the hangout is defined add the reply button to the message
         if raid.hangout is not None:
-            options["reply_markup"] = InlineKeyboardMarkup([[
-                InlineKeyboardButton("\U00002795", callback_data=raid.code + ":a"),
-                InlineKeyboardButton("\U00002796", callback_data=raid.code + ":r"),
-                InlineKeyboardButton("\U0001F3E1", callback_data=raid.code + ":h"),
-                InlineKeyboardButton("\U00002708", callback_data=raid.code + ":f")
-            ]])
+            options["reply_markup"] = self._markup(raid)
 
         # If the reference message is a screenshot, the bot replies to that
         elif message.from_user.id != self._id:
             options["reply_to_message_id"] = message.message_id
 
-        # TODO: improve this check method
         # Check if the old message was pinned
-        try:
-            pinned = self._bot.get_chat(message.chat.id).pinned_message.message_id == message.message_id
-        except AttributeError:
-            pinned = False
+        pinned = int(self._redis.get(redis_keys.CHAT_PINNED.format(message.chat.id)) or 0) == message.message_id
 
         # Try to delete the screenshot if it's necessary
         if message.reply_to_message is not None and raid.hangout is not None:
@@ -558,18 +1034,130 @@ class PoGORaidBot:
             self._try_to_delete(message)
 
         # Send new message
-        new_msg = message.chat.send_message(raid.to_msg(),
-                                            **options)
+        text = raid.to_msg()
+        sent = self._outbox.submit(Priority.SEND, message.chat.id, self._bot.send_message, message.chat.id, text,
+                                   **options)
+        self._then(sent, message.chat.id, self._posted, raid.code,
+                   self._digest(text, options.get("reply_markup")), pinned)
+
+        return sent
+
+    def _posted(self, future: Future, code: str, digest: bytes, pinned: bool) -> None:
+        if future.exception() is not None:
+            # The raid can be posted again by the next screenshot or by a retry
+            self._raids.release_post(code)
+            _LOGGER.warning("Unable to post the raid {}: {}".format(code, future.exception()))
+            return
+
+        new_msg = future.result()
+
+        self._remember(new_msg.chat.id, new_msg.message_id, digest)
+
+        # Keeps track of the message to edit it when the raid ends
+        self._raids.set_message(code, new_msg.message_id)
 
         # Re-pin the new message
         if pinned:
-            self._bot.pin_chat_message(message.chat.id, new_msg.message_id, disable_notification=True)
+            self._outbox.submit(Priority.SEND, new_msg.chat.id, self._bot.pin_chat_message, new_msg.chat.id,
+                                new_msg.message_id, disable_notification=True)
+            self._set_pinned(new_msg.chat.id, new_msg.message_id)
 
-    def _try_to_delete(self, message: Message):
+    def _set_pinned(self, chat_id: int, message_id: int) -> None:
+        self._redis.set(redis_keys.CHAT_PINNED.format(chat_id), message_id)
+
+    def _handle_due_events(self) -> None:
+        # Takes a few events at once, the others are taken by the next runs
+        for event, code in self._raids.pop_due(SCHEDULE_BATCH):
+            try:
+                chat_id = self._raids.get(code).chat_id
+            except (RaidNotFound, InvalidRaid):
+                _LOGGER.info("The raid {} of a due event is no longer available".format(code))
+                self._raids.done(event, code)
+                continue
+
+            # The event is handled after the previous updates of the chat. It isn't retried after a failure,
+            # only if the process stops while it is handled
+            self._executor.submit(chat_id, self._handle_due_event, event, code).add_done_callback(
+                functools.partial(self._done, event, code))
+
+        metrics.set("raidstore.scheduled", self._raids.pending())
+
+    def _done(self, event: str, code: str, _: Future) -> None:
         try:
-            self._bot.delete_message(message.chat.id, message.message_id)
-        except error.BadRequest:
-            _LOGGER.info("The bot hasn't the permission to delete messages")
+            self._raids.done(event, code)
+        except exceptions.RedisError as e:
+            _LOGGER.warning("Unable to mark the event {} of the raid {} as done: {}".format(event, code, e))
+
+    def _handle_due_event(self, event: str, code: str) -> None:
+        # Reads the raid again, it could be changed while the event was waiting for the shard
+        try:
+            raid = self._raids.get(code)
+        except (RaidNotFound, InvalidRaid):
+            _LOGGER.info("The raid {} of a due event is no longer available".format(code))
+            return
+
+        if event == END:
+            self._end_raid(raid)
+        elif event == REMIND:
+            self._remind_raid(raid)
+
+    def _end_raid(self, raid: Raid) -> None:
+        _LOGGER.info("The raid {} is ended".format(raid.code))
+
+        def check(future: Future) -> None:
+            if isinstance(future.exception(), error.BadRequest):
+                _LOGGER.info("The message of the raid {} is no longer available".format(raid.code))
+            elif future.exception() is not None:
+                _LOGGER.warning("Unable to end the message of the raid {}: {}".format(raid.code, future.exception()))
+
+        # Removes the buttons and marks the message as ended, the edit is already built so nobody waits for it
+        if raid.message_id is not None:
+            self._outbox.submit(Priority.EDIT, raid.chat_id, self._bot.edit_message_text,
+                                raid.to_msg(is_ended=True), raid.chat_id, raid.message_id,
+                                disable_web_page_preview=True, parse_mode=ParseMode.MARKDOWN).add_done_callback(check)
+
+        if self._archive is not None:
+            self._archive.append(raid)
+
+        self._raids.delete(raid)
+
+    def _remind_raid(self, raid: Raid) -> None:
+        if raid.participants_count == 0:
+            return
+
+        _LOGGER.info("Reminding the participants of the raid {}".format(raid.code))
+
+        def check(future: Future) -> None:
+            if future.exception() is not None:
+                _LOGGER.warning("Unable to remind the raid {}: {}".format(raid.code, future.exception()))
+
+        self._outbox.submit(Priority.SEND, raid.chat_id, self._bot.send_message, raid.chat_id,
+                            "*{}* at `{}`\n{}".format(raid.gym.name if raid.gym is not None else "Raid",
+                                                       raid.hangout.strftime("%H:%M"),
+                                                       " ".join("[{}](tg://user?id={})".format(p.name, p.id)
+                                                                for p in raid.participants.values())),
+                            parse_mode=ParseMode.MARKDOWN,
+                            reply_to_message_id=raid.message_id,
+                            disable_web_page_preview=True).add_done_callback(check)
+
+    def _reply(self, message: Message, text: str, markdown: bool = True, **kwargs) -> None:
+        """Replies to the message through the outbox, nobody waits for the reply"""
+        def check(future: Future) -> None:
+            if future.exception() is not None:
+                _LOGGER.warning("Unable to reply in the chat {}: {}".format(message.chat.id, future.exception()))
+
+        self._outbox.submit(Priority.SEND, message.chat.id, message.reply_markdown if markdown else message.reply_text,
+                            text, **kwargs).add_done_callback(check)
+
+    def _try_to_delete(self, message: Message):
+        def check(future: Future) -> None:
+            if isinstance(future.exception(), error.BadRequest):
+                _LOGGER.info("The bot hasn't the permission to delete messages")
+
+        # The deletes have the lowest priority, so nobody waits for them
+        self._outbox.submit(Priority.DELETE, message.chat.id, self._bot.delete_message, message.chat.id,
+                            message.message_id).add_done_callback(check)
 
-    def _init_db(self):
-        pass
+    def _init_db(self) -> None:
+        # Converts the raids stored by the older versions
+        self._raids.migrate()
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+from ..metrics import metrics
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class ChatExecutor:
+    """Pool of threads where the tasks of the same chat run in order
+
+    Every chat is assigned to a shard, a thread with its own queue, so the tasks of a chat
+    never run concurrently nor are reordered, while the chats of different shards run in parallel.
+    """
+
+    def __init__(self, workers: int):
+        self._queues: List[queue.Queue] = [queue.Queue() for _ in range(workers)]
+
+        for i, q in enumerate(self._queues):
+            threading.Thread(target=self._work, args=(i, q), name="chat-executor-{}".format(i), daemon=True).start()
+
+    def submit(self, chat_id: int, func: Callable[..., Any], *args, **kwargs) -> Future:
+        """Runs the task after the previous tasks of the chat, the returned future has its result
+
+        A task that runs in a shard must not wait for another task of the same shard.
+        """
+        i = hash(chat_id) % len(self._queues)
+        future = Future()
+
+        self._queues[i].put((future, func, args, kwargs))
+        metrics.set("chatexecutor.shard_{}.queue".format(i), self._queues[i].qsize())
+
+        return future
+
+    def wrap(self, func: Callable[..., Any], chat_id: Callable[..., int]) -> Callable[..., None]:
+        """Returns a function that submits the call to the shard of the chat extracted from its arguments"""
+        def submit(*args, **kwargs) -> None:
+            self.submit(chat_id(*args, **kwargs), func, *args, **kwargs)
+
+        return submit
+
+    def _work(self, i: int, q: queue.Queue) -> None:
+        while True:
+            future, func, args, kwargs = q.get()
+
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                _LOGGER.exception("A task of the shard {} is failed".format(i))
+                future.set_exception(e)
+
+            metrics.set("chatexecutor.shard_{}.queue".format(i), q.qsize())
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Dict, FrozenSet
+
+from redis import StrictRedis, exceptions
+
+from .. import redis_keys
+
+_LOGGER = logging.getLogger(__package__)
+
+# Seconds to wait before reconnecting to the invalidations channel
+_RECONNECT_DELAY = 5
+
+
+class ConfigCache:
+    """In memory copy of the configuration sets (enabled chats, admins, chats with disabled scan)
+
+    The changes are written through to Redis and announced on a channel, so every process
+    that shares the same Redis reloads the changed set and the checks never touch Redis.
+    """
+
+    KEYS = (redis_keys.ENABLEDCHAT, redis_keys.ADMIN, redis_keys.DISABLEDSCAN)
+
+    def __init__(self, redis: StrictRedis):
+        self._redis = redis
+        self._sets: Dict[str, FrozenSet[int]] = {k: frozenset() for k in ConfigCache.KEYS}
+
+        self._reload_all()
+
+        # Listens the invalidations in background
+        threading.Thread(target=self._listen, name="config-cache", daemon=True).start()
+
+    def is_member(self, key: str, value: int) -> bool:
+        return int(value) in self._sets[key]
+
+    def add(self, key: str, value: int) -> None:
+        pipe = self._redis.pipeline()
+        pipe.sadd(key, value)
+        pipe.publish(redis_keys.INVALIDATE, key)
+        pipe.execute()
+
+        self._sets[key] = self._sets[key] | {int(value)}
+
+    def remove(self, key: str, value: int) -> None:
+        pipe = self._redis.pipeline()
+        pipe.srem(key, value)
+        pipe.publish(redis_keys.INVALIDATE, key)
+        pipe.execute()
+
+        self._sets[key] = self._sets[key] - {int(value)}
+
+    def _reload(self, key: str) -> None:
+        self._sets[key] = frozenset(int(v) for v in self._redis.smembers(key))
+        _LOGGER.debug("{} is reloaded with {} entries".format(key, len(self._sets[key])))
+
+    def _reload_all(self) -> None:
+        for k in ConfigCache.KEYS:
+            self._reload(k)
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=False)
+                pubsub.subscribe(redis_keys.INVALIDATE)
+
+                for message in pubsub.listen():
+                    if message["type"] == "subscribe":
+                        # Some invalidations could be lost while the channel was not subscribed
+                        self._reload_all()
+
+                    elif message["type"] == "message":
+                        key = message["data"].decode()
+                        if key in self._sets:
+                            self._reload(key)
+
+            except exceptions.ConnectionError:
+                _LOGGER.warning("The invalidations channel is disconnected")
+                time.sleep(_RECONNECT_DELAY)
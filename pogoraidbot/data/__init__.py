@@ -1,4 +1,5 @@
 from .boss import Boss, BossesList
+from .data import add_reload_job, is_remote, LOCAL_WATCH_INTERVAL
 from .gym import Gym, GymsList
 
 bosses = BossesList()
@@ -1,15 +1,18 @@
 from __future__ import annotations
 
 import csv
-import json
+import logging
 from dataclasses import dataclass
-from io import StringIO
+from typing import Any, Dict, Iterator, List, Tuple, Union
 
 from mpu.string import str2bool
 from schema import Schema, Or, Optional
 
 from .data import Data, DataList
 from .exceptions import InvalidJSON, InvalidCSV
+from .parser import JSONStream
+
+_LOGGER = logging.getLogger(__package__)
 
 
 @dataclass
@@ -19,62 +22,117 @@ class Boss(Data):
 
 
 class BossesList(DataList):
-    def _load_json(self, raw: str) -> None:
-        try:
-            data = json.loads(raw)
-        except ValueError:
-            raise InvalidJSON
+    def __init__(self):
+        super(BossesList, self).__init__()
+
+        # The bosses with the indexes of the candidates for each level, they are replaced together by a reload
+        # The bosses with unknown level are candidates for every level
+        self._partitions: Tuple[List[Boss], Dict[int, List[int]]] = ([], {})
+
+    def find_by_level(self, name: str, level: Union[int, None], minimal_value: float = 0.4,
+                      fallback: bool = True) -> Tuple[Union[Boss, None], Union[int, None]]:
+        """Searches the boss only between the candidates for the level
+
+        If the level is unknown or no candidate is similar enough and the fallback is enabled,
+        the whole list is searched. It returns the boss and the level of the partition that
+        produced it, None if it was found in the whole list.
+        """
+        if not self.is_loaded:
+            return None, None
+
+        bosses, levels = self._partitions
+
+        if level in levels:
+            _LOGGER.debug("Try to find a candidate for '{}' of level {}".format(name, level))
+
+            b = self._most_similar(name, bosses, ((i, bosses[i].name) for i in levels[level]), minimal_value)
+
+            if b is not None or not fallback:
+                return b, level
+
+        return self.find(name, minimal_value), None
+
+    def _set(self, bosses: List[Boss], levels: Dict[int, List[int]] = None) -> None:
+        if levels is None:
+            levels = {}
+            for l in {b.level for b in bosses if b.level is not None}:
+                levels[l] = [i for i, b in enumerate(bosses) if b.level == l or b.level is None]
+
+        self._partitions = (bosses, levels)
+        self[:] = bosses
+
+    def _storage(self) -> List[Boss]:
+        return self._partitions[0]
 
+    def _dump(self) -> Any:
+        bosses, levels = self._partitions
+        return [(b.name, b.level, b.is_there_shiny) for b in bosses], levels
+
+    def _restore(self, data: Any) -> None:
+        bosses, levels = data
+        self._set([Boss(*b) for b in bosses], levels)
+
+    def _load_json(self, stream: JSONStream) -> None:
         # Simple list of boss' names
-        schema1 = Schema([str])
+        schema1 = Schema(str)
 
         # Dictionary of boss' names and level
-        schema2 = Schema({
-            str: Or(1, 2, 3, 4, 5)
-        })
+        schema2 = Schema(Or(1, 2, 3, 4, 5))
 
         # List of Boss objects
-        schema3 = Schema([{
+        schema3 = Schema({
             "name": str,
             Optional("level"): int,
             Optional("is_there_shiny"): bool
-        }])
+        })
 
-        # Check if the list is valid
-        if schema1.is_valid(data):
-            self.clear()
-            for b in data:
-                self.append(Boss(b))
-            return
+        bosses = []
 
-        elif schema2.is_valid(data):
-            self.clear()
-            for b in data:
-                self.append(Boss(
-                    name=b,
-                    level=data[b]
-                ))
-            return
+        # Each entry is validated when it is read, all the entries of a list must have the same schema
+        try:
+            if stream.peek() == "[":
+                schema = None
+                for b in stream.items():
+                    if schema is None:
+                        schema = schema1 if schema1.is_valid(b) else schema3
+
+                    if not schema.is_valid(b):
+                        raise InvalidJSON
 
-        elif schema3.is_valid(data):
-            self.clear()
-            for b in data:
-                self.append(Boss(**b))
-            return
+                    bosses.append(Boss(b) if schema is schema1 else Boss(**b))
 
-        raise InvalidJSON
+            else:
+                for b in stream.members():
+                    level = stream.value()
 
-    def _load_csv(self, raw: str) -> None:
+                    if not schema2.is_valid(level):
+                        raise InvalidJSON
 
-        rows = csv.reader(StringIO(raw), skipinitialspace=True)
+                    bosses.append(Boss(
+                        name=b,
+                        level=level
+                    ))
+
+        except ValueError:
+            raise InvalidJSON
+
+        self._set(bosses)
+
+    def _load_csv(self, lines: Iterator[str]) -> None:
+
+        rows = csv.reader(lines, skipinitialspace=True)
 
         # skips the header row and counts the columns
-        c = len(next(rows))
+        try:
+            c = len(next(rows))
+        except StopIteration:
+            raise InvalidCSV
+
+        bosses = []
 
         if c == 1:
             for row in rows:
-                self.append(Boss(row[0].strip()))
-            return
+                bosses.append(Boss(row[0].strip()))
 
         elif c == 2:
             for row in rows:
@@ -84,8 +142,7 @@ class BossesList(DataList):
                 except:
                     raise InvalidCSV
 
-                self.append(Boss(row[0].strip(), int(row[1].strip())))
-            return
+                bosses.append(Boss(row[0].strip(), int(row[1].strip())))
 
         elif c == 3:
             for row in rows:
@@ -96,7 +153,9 @@ class BossesList(DataList):
                 except:
                     raise InvalidCSV
 
-                self.append(Boss(row[0].strip(), int(row[1].strip()), str2bool(row[2].strip())))
-            return
+                bosses.append(Boss(row[0].strip(), int(row[1].strip()), str2bool(row[2].strip())))
+
+        else:
+            raise InvalidCSV
 
-        raise InvalidCSV
+        self._set(bosses)
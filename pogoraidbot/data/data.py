@@ -1,17 +1,54 @@
 from __future__ import annotations
 
+import datetime
+import hashlib
+import io
+import json
 import logging
+import marshal
+import os
+import struct
+import time
 from dataclasses import dataclass
 from difflib import SequenceMatcher
-from typing import List, Union
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, List, Tuple, Union
 from urllib.parse import urlparse
 
 import requests
+from apscheduler.schedulers.base import BaseScheduler
 
 from .exceptions import InvalidJSON, InvalidCSV
+from .parser import CHUNK_SIZE, IterableReader, JSONStream, Source
 
 _LOGGER = logging.getLogger(__package__)
 
+# Seconds to wait for the remote host before giving up
+HTTP_TIMEOUT = 10
+
+# Seconds between two checks for changes of a local file
+LOCAL_WATCH_INTERVAL = 60
+
+
+# Version of the snapshots layout, it must be increased every time _dump changes
+SNAPSHOT_VERSION = 2
+
+_SNAPSHOT_MAGIC = b"PGRBSNAP"
+_SNAPSHOT_HEADER = struct.Struct("<8sHH")
+
+
+def is_remote(file: str) -> bool:
+    return bool(urlparse(file).scheme)
+
+
+def add_reload_job(scheduler: BaseScheduler, job: Callable[[], bool], file: str, expiration: int) -> None:
+    """Adds to the scheduler the job that reloads a list from the file"""
+    # A local file is reloaded only if it is changed, so it can be checked often
+    if is_remote(file):
+        # The first check is at once, the list could be loaded from the local copy of the remote file
+        scheduler.add_job(job, 'interval', hours=int(expiration), next_run_time=datetime.datetime.now())
+    else:
+        scheduler.add_job(job, 'interval', seconds=LOCAL_WATCH_INTERVAL)
+
 
 @dataclass
 class Data:
@@ -23,47 +60,254 @@ class DataList(List):
         super(DataList, self).__init__()
         self._is_loaded = False
 
+        # Validators of the last loaded version of the source
+        self._etag = None
+        self._last_modified = None
+        self._mtime = None
+
+        # Path of the snapshot of the loaded list
+        self._snapshot = None
+
     @property
     def is_loaded(self) -> bool:
         return self._is_loaded
 
-    def load_from(self, file: str) -> bool:
+    def load_from(self, file: str, cache_folder: str = None) -> bool:
         _LOGGER.info("Try to load {}".format(self.__class__.__name__))
 
+        # Check if the resource is remote
+        if is_remote(file):
+            return self._load_remote(file, cache_folder)
+
+        return self._load_local(file, cache_folder)
+
+    def _load_local(self, file: str, cache_folder: str = None) -> bool:
         try:
-            # Check if the resource is remote
-            if bool(urlparse(file).scheme):
-                # Load the remote json
-                raw = requests.get(file).text
+            mtime = os.stat(file).st_mtime_ns
 
-            else:
-                # Open the file and load it as json
-                with open(file, 'r') as f:
-                    raw = f.read()
+            # Check if the file is changed since the last load
+            if self.is_loaded and mtime == self._mtime:
+                _LOGGER.info("{} is already up to date".format(self.__class__.__name__))
+                return True
+
+            # Open the file and load it
+            if not self._load_file(file, cache_folder):
+                return False
 
         except FileNotFoundError:
             _LOGGER.warning("Failed to load the list: file not found")
             return False
-        except requests.exceptions.ConnectionError:
+
+        self._mtime = mtime
+
+        return True
+
+    def _load_remote(self, url: str, cache_folder: str = None) -> bool:
+        cache = None
+        if cache_folder is not None:
+            cache = os.path.join(cache_folder, hashlib.sha1(url.encode()).hexdigest())
+
+            # At the startup uses the local copy of the remote file to be ready without wait the remote host,
+            # the reload job checks the remote file in background
+            if not self.is_loaded and self._load_cache(cache, cache_folder):
+                return True
+
+        # Asks the remote file only if it is changed since the last load
+        headers = {}
+        if self.is_loaded:
+            if self._etag is not None:
+                headers["If-None-Match"] = self._etag
+            if self._last_modified is not None:
+                headers["If-Modified-Since"] = self._last_modified
+
+        try:
+            # Load the remote file
+            with requests.get(url, headers=headers, timeout=HTTP_TIMEOUT, stream=True) as response:
+                if response.status_code == 304:
+                    _LOGGER.info("{} is already up to date".format(self.__class__.__name__))
+                    return True
+
+                if response.status_code != 200:
+                    _LOGGER.warning("Failed to load the list: the remote host replied {}"
+                                    .format(response.status_code))
+                    return False
+
+                chunks = response.iter_content(CHUNK_SIZE)
+
+                # Without a local copy the file is parsed while it is downloaded
+                if cache is None:
+                    if not self._parse(io.BufferedReader(IterableReader(chunks))):
+                        return False
+
+                elif not self._download(cache, chunks, cache_folder):
+                    return False
+
+                self._etag = response.headers.get("ETag")
+                self._last_modified = response.headers.get("Last-Modified")
+
+        except requests.exceptions.RequestException:
             _LOGGER.warning("Failed to load the list: an HTTP error occurred")
             return False
 
+        if cache is not None:
+            self._save_cache_meta(cache)
+
+        return True
+
+    def _load_cache(self, cache: str, cache_folder: str) -> bool:
         try:
-            self._load_json(raw)
-            self._is_loaded = True
-        except (InvalidJSON, NotImplementedError):
-            pass
+            with open(cache + ".meta", 'r') as f:
+                meta = json.load(f)
 
+            _LOGGER.info("Found a local copy of the remote file")
+
+            if not self._load_file(cache, cache_folder):
+                return False
+
+        except (OSError, ValueError):
+            return False
+
+        self._etag = meta.get("etag")
+        self._last_modified = meta.get("last_modified")
+
+        return True
+
+    def _download(self, cache: str, chunks: Iterator[bytes], cache_folder: str) -> bool:
         try:
-            self._load_csv(raw)
-            self._is_loaded = True
-        except (InvalidCSV, NotImplementedError):
-            pass
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
 
-        if not self.is_loaded:
+            # Writes the file before and then replaces the old one, so a broken copy is never left
+            with open(cache + ".tmp", 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+
+            if not self._load_file(cache + ".tmp", cache_folder):
+                os.remove(cache + ".tmp")
+                return False
+
+            os.replace(cache + ".tmp", cache)
+
+        except OSError:
+            _LOGGER.warning("Unable to save the local copy of the remote file")
+            return False
+
+        return True
+
+    def _save_cache_meta(self, cache: str) -> None:
+        try:
+            with open(cache + ".meta.tmp", 'w') as f:
+                json.dump({"etag": self._etag, "last_modified": self._last_modified}, f)
+
+            os.replace(cache + ".meta.tmp", cache + ".meta")
+
+        except OSError:
+            _LOGGER.warning("Unable to save the local copy of the remote file")
+
+    def _load_file(self, file: str, cache_folder: str = None) -> bool:
+        # Without a cache folder there is no place for the snapshots
+        if cache_folder is None:
+            with open(file, 'rb') as f:
+                return self._parse(f)
+
+        # The snapshot is identified by the content of the source
+        h = hashlib.sha256()
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+
+        snapshot = os.path.join(cache_folder, "{}-{}.snapshot".format(self.__class__.__name__.lower(), h.hexdigest()))
+
+        if self._load_snapshot(snapshot):
+            return True
+
+        start = time.perf_counter()
+
+        with open(file, 'rb') as f:
+            if not self._parse(f):
+                return False
+
+        self._save_snapshot(snapshot, time.perf_counter() - start)
+
+        return True
+
+    def _load_snapshot(self, snapshot: str) -> bool:
+        start = time.perf_counter()
+
+        try:
+            with open(snapshot, 'rb') as f:
+                magic, version, marshal_version = _SNAPSHOT_HEADER.unpack(f.read(_SNAPSHOT_HEADER.size))
+
+                if magic != _SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or marshal_version != marshal.version:
+                    _LOGGER.info("The snapshot was created by another version")
+                    return False
+
+                parse_time, data = marshal.load(f)
+
+            self._restore(data)
+
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, EOFError, TypeError, struct.error, NotImplementedError):
+            _LOGGER.warning("Unable to read the snapshot")
+            return False
+
+        # It is removed when the source changes
+        self._snapshot = snapshot
+
+        self._is_loaded = True
+
+        _LOGGER.debug(self)
+
+        _LOGGER.info("{} is loaded from the snapshot with {} entities in {:.1f} ms instead of {:.1f} ms"
+                     .format(self.__class__.__name__, len(self), (time.perf_counter() - start) * 1000,
+                             parse_time * 1000))
+
+        return True
+
+    def _save_snapshot(self, snapshot: str, parse_time: float) -> None:
+        try:
+            data = self._dump()
+        except NotImplementedError:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+
+            with open(snapshot + ".tmp", 'wb') as f:
+                f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, SNAPSHOT_VERSION, marshal.version))
+                marshal.dump((parse_time, data), f)
+
+            os.replace(snapshot + ".tmp", snapshot)
+
+        except OSError:
+            _LOGGER.warning("Unable to save the snapshot")
+            return
+
+        # Remove the snapshot of the previous version of the source
+        if self._snapshot is not None and self._snapshot != snapshot:
+            try:
+                os.remove(self._snapshot)
+            except OSError:
+                pass
+
+        self._snapshot = snapshot
+
+    def _parse(self, file: BinaryIO) -> bool:
+        try:
+            source = Source(file)
+
+            # The format is sniffed once, then the file is parsed in a single pass
+            if source.is_json:
+                self._load_json(source.json_stream())
+            else:
+                self._load_csv(source.lines())
+
+        except (InvalidJSON, InvalidCSV, NotImplementedError, UnicodeDecodeError):
             _LOGGER.warning("The file is in a wrong format")
             return False
 
+        self._is_loaded = True
+
         _LOGGER.debug(self)
 
         _LOGGER.info("{} is loaded with {} entities".format(self.__class__.__name__, len(self)))
@@ -75,21 +319,46 @@ class DataList(List):
             return None
 
         _LOGGER.debug("Try to find a candidate for '{}'".format(name))
-        # Compare the boss_name with each boss in the list and find the most similar
 
-        values = map(lambda x: (x, SequenceMatcher(None, name.lower(), x.name.lower()).ratio()), self)
+        # A reload replaces the storage, so the entity is taken from the same storage that is scored
+        storage = self._storage()
 
-        value = max(values, key=lambda x: x[1])
+        return self._most_similar(name, storage, enumerate(self._names(storage)), minimal_value)
+
+    def _most_similar(self, name: str, storage: Any, candidates: Iterable[Tuple[int, str]],
+                      minimal_value: float) -> Union[Data, None]:
+        # Compare the name with each candidate and find the most similar
+        values = map(lambda x: (x[0], SequenceMatcher(None, name.lower(), x[1].lower()).ratio()), candidates)
+
+        value = max(values, key=lambda x: x[1], default=(None, 0))
 
         if value[1] >= minimal_value:
-            _LOGGER.debug("Found '{}' with confidence {:.3f}".format(value[0].name, value[1]))
-            return value[0]
+            entity = self._entity(storage, value[0])
+            _LOGGER.debug("Found '{}' with confidence {:.3f}".format(entity.name, value[1]))
+            return entity
         else:
             _LOGGER.debug("No candidate found")
             return None
 
-    def _load_json(self, raw):
+    def _storage(self) -> Any:
+        """Returns the current storage of the entities, a reload replaces it instead of changing it"""
+        return list(self)
+
+    def _names(self, storage: Any) -> Iterator[str]:
+        return (x.name for x in storage)
+
+    def _entity(self, storage: Any, i: int) -> Data:
+        return storage[i]
+
+    def _dump(self) -> Any:
+        """Returns the content of the list, with its indexes, as objects supported by marshal"""
+        raise NotImplementedError
+
+    def _restore(self, data: Any) -> None:
+        raise NotImplementedError
+
+    def _load_json(self, stream: JSONStream) -> None:
         raise NotImplementedError
 
-    def _load_csv(self, raw):
+    def _load_csv(self, lines: Iterator[str]) -> None:
         raise NotImplementedError
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
-import json
+import csv
+import math
+from array import array
 from dataclasses import dataclass
-from typing import Union, List
+from typing import Any, Union, List, Iterator
 
 from .data import DataList, Data
-from .exceptions import InvalidJSON
+from .exceptions import InvalidJSON, InvalidCSV
+from .parser import JSONStream
 
 gyms: Union[List[Gym], None] = None
 
@@ -16,28 +19,155 @@ class Gym(Data):
     longitude: float = None
 
 
+class _GymsColumns:
+    """Gyms stored by columns, the names are kept encoded one after the other in a single buffer"""
+    __slots__ = ("names", "offsets", "latitudes", "longitudes")
+
+    def __init__(self):
+        self.names = bytearray()
+        # The name of the i-th gym is between offsets[i] and offsets[i + 1]
+        self.offsets = array("L", [0])
+        # The missing coordinates are stored as NaN
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + sum(c.__sizeof__() for c in (self.names, self.offsets,
+                                                                       self.latitudes, self.longitudes))
+
+    def append(self, name: str, latitude: Union[float, None], longitude: Union[float, None]) -> None:
+        self.names += name.encode()
+        self.offsets.append(len(self.names))
+        self.latitudes.append(math.nan if latitude is None else latitude)
+        self.longitudes.append(math.nan if longitude is None else longitude)
+
+    def name(self, i: int) -> str:
+        return self.names[self.offsets[i]:self.offsets[i + 1]].decode()
+
+    def gym(self, i: int) -> Gym:
+        latitude = self.latitudes[i]
+        longitude = self.longitudes[i]
+
+        return Gym(self.name(i),
+                   None if math.isnan(latitude) else latitude,
+                   None if math.isnan(longitude) else longitude)
+
+
 class GymsList(DataList):
-    def _load_json(self, raw: str) -> None:
+    def __init__(self):
+        super(GymsList, self).__init__()
+        self._columns = _GymsColumns()
+
+    def __len__(self) -> int:
+        return len(self._columns)
+
+    def __iter__(self) -> Iterator[Gym]:
+        columns = self._columns
+        return (columns.gym(i) for i in range(len(columns)))
+
+    def __getitem__(self, i: int) -> Gym:
+        if i < 0:
+            i += len(self._columns)
+        if not 0 <= i < len(self._columns):
+            raise IndexError("gym index out of range")
+
+        # The Gym object is created only when it is required
+        return self._columns.gym(i)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def __sizeof__(self) -> int:
+        return super(GymsList, self).__sizeof__() + self._columns.__sizeof__()
+
+    def append(self, gym: Gym) -> None:
+        self._columns.append(gym.name, gym.latitude, gym.longitude)
+
+    def clear(self) -> None:
+        self._columns = _GymsColumns()
+
+    def _storage(self) -> _GymsColumns:
+        return self._columns
+
+    def _names(self, columns: _GymsColumns) -> Iterator[str]:
+        return (columns.name(i) for i in range(len(columns)))
+
+    def _entity(self, columns: _GymsColumns, i: int) -> Gym:
+        return columns.gym(i)
+
+    def _dump(self) -> Any:
+        columns = self._columns
+        return (bytes(columns.names), columns.offsets.tobytes(),
+                columns.latitudes.tobytes(), columns.longitudes.tobytes())
+
+    def _restore(self, data: Any) -> None:
+        names, offsets, latitudes, longitudes = data
+
+        columns = _GymsColumns()
+        columns.names = bytearray(names)
+        columns.offsets = array("L")
+        columns.offsets.frombytes(offsets)
+        columns.latitudes.frombytes(latitudes)
+        columns.longitudes.frombytes(longitudes)
+
+        self._columns = columns
+
+    def _load_json(self, stream: JSONStream) -> None:
+        # Add each gyms to a new storage and then replace the old one, so the lookups never see a partial list
+        columns = _GymsColumns()
+
         try:
-            data = json.loads(raw)
-        except ValueError:
-            raise InvalidJSON
+            # Try to find a list of gyms in first level of the file
+            for _ in stream.members():
+                if stream.peek() != "[":
+                    # Skip the value
+                    stream.value()
+                    continue
 
-        # Try to find a list of gyms in first level of the file
-        gyms_raw = None
-        for _, l in data.items():
-            if isinstance(l, list):
-                if isinstance(l[0], dict):
-                    if "name" in l[0] and "latitude" in l[0] and "longitude" in l[0]:
-                        gyms_raw = l
+                items = stream.items()
+                for g in items:
+                    # Check if the list contains gyms looking at its first element
+                    if len(columns) == 0 and \
+                            not (isinstance(g, dict) and "name" in g and "latitude" in g and "longitude" in g):
                         break
 
+                    columns.append(g["name"], g["latitude"], g["longitude"])
+
+                if len(columns) > 0:
+                    break
+
+                # Skip the rest of the list
+                for _ in items:
+                    pass
+
+        except (ValueError, KeyError, TypeError):
+            raise InvalidJSON
+
         # Check if a list is found
-        if gyms_raw is None:
+        if len(columns) == 0:
             raise InvalidJSON
 
-        self.clear()
+        self._columns = columns
+
+    def _load_csv(self, lines: Iterator[str]) -> None:
+        rows = csv.reader(lines, skipinitialspace=True)
+
+        # Find the columns from the header row
+        try:
+            header = [h.strip().lower() for h in next(rows)]
+            name, latitude, longitude = (header.index(h) for h in ("name", "latitude", "longitude"))
+        except (StopIteration, ValueError):
+            raise InvalidCSV
+
+        columns = _GymsColumns()
+
+        for row in rows:
+            try:
+                columns.append(row[name].strip(), float(row[latitude]), float(row[longitude]))
+            except (IndexError, ValueError):
+                raise InvalidCSV
 
-        # Add each gyms to the list
-        for g in gyms_raw:
-            self.append(Gym(g["name"], g["latitude"], g["longitude"]))
+        self._columns = columns
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import io
+import itertools
+import json
+import re
+from typing import Any, BinaryIO, Iterable, Iterator
+
+# Amount of characters read from the source at once
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r"\s*")
+
+# Characters that can continue a number truncated by the end of the buffer (e.g. "12." or "1e")
+_NUMBER_TAIL = re.compile(r"[.eE+\-]*")
+
+_DECODER = json.JSONDecoder()
+
+
+class IterableReader(io.RawIOBase):
+    """Binary file-like object that reads from an iterable of bytes (e.g. a streamed HTTP response)"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        super(IterableReader, self).__init__()
+        self._chunks = iter(chunks)
+        self._chunk = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._chunk:
+            try:
+                self._chunk = next(self._chunks)
+            except StopIteration:
+                return 0
+
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+
+        return n
+
+
+class Source:
+    """Text source whose format is sniffed once from its first meaningful character"""
+
+    def __init__(self, file: BinaryIO):
+        self._file = io.TextIOWrapper(file, encoding="utf-8-sig")
+
+        # Skip the leading whitespaces
+        self._first = self._file.read(1)
+        while self._first.isspace():
+            self._first = self._file.read(1)
+
+    @property
+    def is_json(self) -> bool:
+        return self._first in ("[", "{")
+
+    def lines(self) -> Iterator[str]:
+        return itertools.chain([self._first + self._file.readline()], self._file)
+
+    def json_stream(self) -> JSONStream:
+        return JSONStream(itertools.chain([self._first], iter(lambda: self._file.read(CHUNK_SIZE), "")))
+
+
+class JSONStream:
+    """Incremental JSON parser, it keeps in memory only the value that is currently decoded
+
+    Malformed or truncated documents raise ValueError.
+    """
+
+    def __init__(self, chunks: Iterator[str]):
+        self._chunks = chunks
+        self._buffer = ""
+        self._pos = 0
+
+    def _fill(self) -> bool:
+        chunk = next(self._chunks, "")
+        if not chunk:
+            return False
+
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+
+        return True
+
+    def _skip_whitespace(self) -> None:
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+
+            if self._pos < len(self._buffer):
+                return
+
+            if not self._fill():
+                raise ValueError("Unexpected end of the document")
+
+    def peek(self) -> str:
+        self._skip_whitespace()
+        return self._buffer[self._pos]
+
+    def _expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError("Expected '{}' at {}".format(char, self._pos))
+        self._pos += 1
+
+    def value(self) -> Any:
+        self._skip_whitespace()
+
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                # The value could be truncated by the end of the buffer
+                if not self._fill():
+                    raise
+                continue
+
+            # A number at the end of the buffer could continue in the next chunk
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and \
+                    _NUMBER_TAIL.fullmatch(self._buffer, end) and self._fill():
+                continue
+
+            self._pos = end
+            return value
+
+    def items(self) -> Iterator[Any]:
+        """Yields the items of the array that starts at the current position"""
+        self._expect("[")
+
+        if self.peek() == "]":
+            self._pos += 1
+            return
+
+        while True:
+            yield self.value()
+
+            char = self.peek()
+            self._pos += 1
+
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError("Expected ',' or ']' at {}".format(self._pos - 1))
+
+    def members(self) -> Iterator[str]:
+        """Yields the keys of the object that starts at the current position
+
+        After each key the caller must consume its value with value() or items().
+        """
+        self._expect("{")
+
+        if self.peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError("Expected a key at {}".format(self._pos))
+
+            self._expect(":")
+
+            yield key
+
+            char = self.peek()
+            self._pos += 1
+
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError("Expected ',' or '}}' at {}".format(self._pos - 1))
+
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable
+
+from ..metrics import metrics
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class Debouncer:
+    """Runs at most one update per key in every window
+
+    The first call for a key runs immediately. The calls that arrive during the window
+    are coalesced in a single call at the end of the window, and only the last one is run.
+    """
+
+    def __init__(self, window: float):
+        self._window = window
+        self._lock = threading.Lock()
+
+        # Time of the last run of every key
+        self._last: Dict[Hashable, float] = {}
+        # Call waiting for the end of the window of every key
+        self._pending: Dict[Hashable, Callable[[], None]] = {}
+
+    def call(self, key: Hashable, now: Callable[[], None], later: Callable[[], None]) -> None:
+        """Runs now if the key wasn't updated in the window, otherwise later at the end of the window
+
+        The delayed call is expected to read the latest state by itself.
+        """
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = later
+                metrics.observe("debouncer.coalesced")
+                return
+
+            delay = self._last.get(key, 0) + self._window - time.monotonic()
+
+            if delay > 0:
+                self._pending[key] = later
+                timer = threading.Timer(delay, self._fire, args=(key,))
+                timer.daemon = True
+                timer.start()
+                return
+
+            self._last[key] = time.monotonic()
+            self._cleanup()
+
+        now()
+
+    def _fire(self, key: Hashable) -> None:
+        with self._lock:
+            func = self._pending.pop(key)
+            self._last[key] = time.monotonic()
+
+        try:
+            func()
+        except Exception:
+            _LOGGER.exception("The delayed update of {} is failed".format(key))
+
+    def _cleanup(self) -> None:
+        # Forgets the keys whose window is passed
+        if len(self._last) > 1024:
+            limit = time.monotonic() - self._window
+            self._last = {k: t for k, t in self._last.items() if t > limit or k in self._pending}
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Callable, Dict, List
+
+from telegram import Message
+
+_LOGGER = logging.getLogger(__package__)
+
+# Maximum number of messages of a media group
+MAX_SIZE = 10
+
+
+class MediaGroupCollector:
+    """Collects the messages of a media group (album), which Telegram sends as separate updates
+
+    The group is handed over when the window from its first message is passed,
+    or as soon as it is complete.
+    """
+
+    def __init__(self, window: float, handler: Callable[[List[Message]], None]):
+        self._window = window
+        self._handler = handler
+
+        self._lock = threading.Lock()
+        self._groups: Dict[str, List[Message]] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+
+    def add(self, message: Message) -> None:
+        group_id = message.media_group_id
+
+        with self._lock:
+            if group_id not in self._groups:
+                self._groups[group_id] = []
+
+                timer = threading.Timer(self._window, self._flush, args=(group_id,))
+                timer.daemon = True
+                self._timers[group_id] = timer
+                timer.start()
+
+            self._groups[group_id].append(message)
+            complete = len(self._groups[group_id]) >= MAX_SIZE
+
+        if complete:
+            self._flush(group_id)
+
+    def _flush(self, group_id: str) -> None:
+        with self._lock:
+            # The group could be already flushed
+            messages = self._groups.pop(group_id, None)
+            timer = self._timers.pop(group_id, None)
+
+        if messages is None:
+            return
+
+        timer.cancel()
+
+        _LOGGER.info("The media group {} has {} messages".format(group_id, len(messages)))
+
+        try:
+            self._handler(sorted(messages, key=lambda m: m.message_id))
+        except Exception:
+            _LOGGER.exception("The media group {} is failed".format(group_id))
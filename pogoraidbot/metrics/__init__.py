@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Union
+
+_LOGGER = logging.getLogger(__package__)
+
+
+@dataclass
+class Observation:
+    count: int = 0
+    total: float = 0
+    max: float = 0
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count > 0 else 0
+
+
+class Metrics:
+    """Thread safe collection of the internal metrics of the bot"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._observations: Dict[str, Observation] = {}
+        self._gauges: Dict[str, float] = {}
+
+    def observe(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            o = self._observations.setdefault(name, Observation())
+            o.count += 1
+            o.total += value
+            o.max = max(o.max, value)
+
+    def set(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def snapshot(self) -> Dict[str, Union[Observation, float]]:
+        with self._lock:
+            return {
+                **{k: Observation(o.count, o.total, o.max) for k, o in self._observations.items()},
+                **self._gauges
+            }
+
+    def log(self) -> None:
+        for name, value in sorted(self.snapshot().items()):
+            if isinstance(value, Observation):
+                _LOGGER.info("{}: count {} avg {:.3f} max {:.3f}".format(name, value.count, value.average,
+                                                                         value.max))
+            else:
+                _LOGGER.info("{}: {}".format(name, value))
+
+
+metrics = Metrics()
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict
+
+from redis import StrictRedis, exceptions
+from redis.client import Pipeline
+
+from ..metrics import metrics
+
+_LOGGER = logging.getLogger(__package__)
+
+# Consumer groups of the jobs and of the results
+JOBS_GROUP = "workers"
+RESULTS_GROUP = "bots"
+
+# Approximate maximum length of a stream
+MAXLEN = 10000
+
+# Milliseconds a read waits for new entries
+BLOCK = 5000
+
+# Seconds after which an entry delivered but not acknowledged is delivered to another consumer
+CLAIM_TIMEOUT = 60
+
+# Deliveries after which an entry is dropped
+MAX_DELIVERIES = 3
+
+# Seconds between two checks of the pending entries
+CHECK_INTERVAL = 15
+
+# Seconds to wait before reconnecting to Redis
+_RECONNECT_DELAY = 5
+
+
+def consumer_name() -> str:
+    return "{}-{}".format(socket.gethostname(), os.getpid())
+
+
+def _timestamp(entry_id: bytes) -> float:
+    """Returns when the entry was added, its id begins with the milliseconds from the epoch"""
+    return int(entry_id.split(b"-")[0]) / 1000
+
+
+def push(redis: StrictRedis, stream: str, fields: Dict[str, bytes], pipe: Pipeline = None) -> None:
+    """Appends an entry to the stream, within the pipeline if it is provided"""
+    (pipe if pipe is not None else redis).xadd(stream, fields, maxlen=MAXLEN)
+
+
+class StreamConsumer:
+    """Consumer of a Redis Stream in a consumer group
+
+    Every entry is delivered to a single consumer of the group and it is acknowledged in the same
+    transaction of the commands added by the handler to the pipeline. If the handler fails, the entry
+    stays pending and after a timeout it is claimed again by a consumer, until it is dropped after
+    too many deliveries. The backlog of the stream is published in the metrics.
+    """
+
+    def __init__(self, redis: StrictRedis, stream: str, group: str,
+                 handler: Callable[[Dict[bytes, bytes], Pipeline], None]):
+        self._redis = redis
+        self._stream = stream
+        self._group = group
+        self._handler = handler
+        self._name = consumer_name()
+
+        try:
+            self._redis.xgroup_create(self._stream, self._group, id="0", mkstream=True)
+        except exceptions.ResponseError as e:
+            # The group already exists
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def start(self) -> None:
+        threading.Thread(target=self.run, name=self._stream, daemon=True).start()
+
+    def run(self) -> None:
+        checked = 0.0
+
+        while True:
+            try:
+                if time.monotonic() - checked > CHECK_INTERVAL:
+                    self._claim_stuck()
+                    self._update_metrics()
+                    checked = time.monotonic()
+
+                for _, entries in self._redis.xreadgroup(self._group, self._name, {self._stream: ">"},
+                                                         count=1, block=BLOCK) or []:
+                    for entry_id, fields in entries:
+                        self._handle(entry_id, fields)
+
+            except exceptions.ConnectionError:
+                _LOGGER.warning("The stream {} is disconnected".format(self._stream))
+                time.sleep(_RECONNECT_DELAY)
+            except exceptions.RedisError:
+                _LOGGER.exception("Unable to read the stream {}".format(self._stream))
+                time.sleep(_RECONNECT_DELAY)
+
+    def _handle(self, entry_id: bytes, fields: Dict[bytes, bytes]) -> None:
+        metrics.observe("{}.wait".format(self._stream), time.time() - _timestamp(entry_id))
+
+        pipe = self._redis.pipeline()
+        try:
+            self._handler(fields, pipe)
+        except Exception:
+            _LOGGER.exception("The entry {} of {} is failed".format(entry_id, self._stream))
+            metrics.observe("{}.failed".format(self._stream))
+            return
+
+        pipe.xack(self._stream, self._group, entry_id)
+        pipe.execute()
+
+    def _claim_stuck(self) -> None:
+        for p in self._redis.xpending_range(self._stream, self._group, "-", "+", 100):
+            if p["time_since_delivered"] < int(CLAIM_TIMEOUT * 1000):
+                continue
+
+            if p["times_delivered"] >= MAX_DELIVERIES:
+                _LOGGER.warning("The entry {} of {} is dropped after {} deliveries"
+                                .format(p["message_id"], self._stream, p["times_delivered"]))
+                self._redis.xack(self._stream, self._group, p["message_id"])
+                metrics.observe("{}.dropped".format(self._stream))
+                continue
+
+            # The consumer that had the entry is stuck or dead
+            for entry_id, fields in self._redis.xclaim(self._stream, self._group, self._name,
+                                                       int(CLAIM_TIMEOUT * 1000), [p["message_id"]]):
+                if fields is not None:
+                    metrics.observe("{}.retried".format(self._stream))
+                    self._handle(entry_id, fields)
+
+    def _update_metrics(self) -> None:
+        group = next(g for g in self._redis.xinfo_groups(self._stream) if g["name"].decode() == self._group)
+
+        # The lag is the age of the oldest entry not delivered yet
+        last = group["last-delivered-id"]
+        entries = [e for e, _ in self._redis.xrange(self._stream, min=last, count=2) if e != last]
+        lag = time.time() - _timestamp(entries[0]) if len(entries) > 0 else 0
+
+        metrics.set("{}.lag".format(self._stream), lag)
+        metrics.set("{}.pending".format(self._stream), group["pending"])
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Dict, List, Set, Tuple, Union
+
+from telegram import error
+
+from ..metrics import metrics
+
+_LOGGER = logging.getLogger(__package__)
+
+# Limits of Telegram as (requests per second, burst)
+GLOBAL_LIMIT = (30, 30)
+GROUP_LIMIT = (20 / 60, 5)
+PRIVATE_LIMIT = (1, 1)
+
+# Number of the requests that are sent at the same time
+WORKERS = 4
+
+# Seconds between two removals of the buckets of the chats that are full again
+CLEANUP_INTERVAL = 60
+
+
+class Priority(IntEnum):
+    CALLBACK = 0
+    EDIT = 1
+    SEND = 2
+    DELETE = 3
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked = 0.0
+
+    def _refill(self, now: float) -> None:
+        # A bucket created after the time was read is already up to date
+        if now <= self._updated:
+            return
+
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def delay(self, now: float) -> float:
+        """Returns the seconds before a token is available"""
+        self._refill(now)
+        return max(self._blocked - now, (1 - self._tokens) / self._rate, 0)
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self._tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        """Checks if the bucket is as a new one"""
+        self._refill(now)
+        return self._tokens >= self._capacity and self._blocked <= now
+
+    def block(self, now: float, seconds: float) -> None:
+        """Stops the bucket, e.g. after a flood control error"""
+        self._blocked = max(self._blocked, now + seconds)
+        self._tokens = 0
+        self._updated = now
+
+
+@dataclass(order=True)
+class _Request:
+    priority: int
+    seq: int
+    chat_id: Union[int, None] = field(compare=False)
+    func: Callable[..., Any] = field(compare=False)
+    args: tuple = field(compare=False)
+    kwargs: dict = field(compare=False)
+    future: Future = field(compare=False, default_factory=Future)
+    submitted: float = field(compare=False, default_factory=time.monotonic)
+
+
+class Outbox:
+    """Scheduler of the requests to Telegram
+
+    A request waits until both the global and its chat's token buckets have a token,
+    the requests with the higher priority go first, and the requests of the same
+    priority keep their order. A request is taken only when a worker can send it at once,
+    so the priorities and the limits apply to the sends, and the requests of a chat are
+    sent one at a time, so they arrive in order. A request refused by the flood control
+    is retried after the requested time.
+    """
+
+    def __init__(self, workers: int = WORKERS):
+        self._cond = threading.Condition()
+        self._queue: List[_Request] = []
+        self._seq = itertools.count()
+
+        self._global = TokenBucket(*GLOBAL_LIMIT)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._cleaned = time.monotonic()
+
+        # Chats with a request that is being sent
+        self._sending: Set[int] = set()
+
+        self._free = threading.Semaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbox")
+
+        threading.Thread(target=self._dispatch, name="outbox", daemon=True).start()
+
+    def submit(self, priority: Priority, chat_id: Union[int, None],
+               func: Callable[..., Any], *args, **kwargs) -> Future:
+        """Enqueues a call to the bot, the chat is None for the requests that aren't limited per chat"""
+        request = _Request(priority, next(self._seq), chat_id, func, args, kwargs)
+
+        self._enqueue(request)
+
+        return request.future
+
+    def _enqueue(self, request: _Request) -> None:
+        with self._cond:
+            self._queue.append(request)
+            metrics.set("outbox.queue_depth", len(self._queue))
+            self._cond.notify()
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        if chat_id not in self._chats:
+            self._chats[chat_id] = TokenBucket(*(GROUP_LIMIT if chat_id < 0 else PRIVATE_LIMIT))
+        return self._chats[chat_id]
+
+    def _next(self, now: float) -> Tuple[Union[_Request, None], Union[float, None]]:
+        """Returns the first request that can be sent, otherwise the seconds to wait"""
+        wait = None
+
+        self._cleanup(now)
+
+        global_delay = self._global.delay(now)
+        if global_delay > 0:
+            return None, global_delay
+
+        for request in sorted(self._queue):
+            # The next request of the chat is taken when the one being sent is done
+            if request.chat_id in self._sending:
+                continue
+
+            delay = self._bucket(request.chat_id).delay(now) if request.chat_id is not None else 0
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+
+            self._queue.remove(request)
+            self._global.take(now)
+            if request.chat_id is not None:
+                self._bucket(request.chat_id).take(now)
+                self._sending.add(request.chat_id)
+
+            return request, None
+
+        return None, wait
+
+    def _cleanup(self, now: float) -> None:
+        # A full bucket is the same as a new one, so it can be forgotten
+        if now - self._cleaned < CLEANUP_INTERVAL:
+            return
+
+        self._chats = {c: b for c, b in self._chats.items() if not b.is_full(now)}
+        self._cleaned = now
+
+        metrics.set("outbox.buckets", len(self._chats))
+
+    def _dispatch(self) -> None:
+        while True:
+            # Waits for a free worker
+            self._free.acquire()
+
+            with self._cond:
+                while True:
+                    request, wait = self._next(time.monotonic())
+                    if request is not None:
+                        break
+                    self._cond.wait(wait)
+
+                metrics.set("outbox.queue_depth", len(self._queue))
+
+            metrics.observe("outbox.wait", time.monotonic() - request.submitted)
+
+            self._executor.submit(self._run, request)
+
+    def _run(self, request: _Request) -> None:
+        try:
+            request.future.set_result(request.func(*request.args, **request.kwargs))
+
+        except error.RetryAfter as e:
+            _LOGGER.warning("Flood control of chat {}, retry in {} seconds".format(request.chat_id, e.retry_after))
+            metrics.observe("outbox.retry_after")
+
+            with self._cond:
+                bucket = self._bucket(request.chat_id) if request.chat_id is not None else self._global
+                bucket.block(time.monotonic(), e.retry_after)
+
+            self._enqueue(request)
+
+        except Exception as e:
+            request.future.set_exception(e)
+
+        finally:
+            with self._cond:
+                self._sending.discard(request.chat_id)
+                self._cond.notify()
+
+            self._free.release()
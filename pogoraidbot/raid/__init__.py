@@ -3,16 +3,70 @@ from __future__ import annotations
 import datetime
 import random
 import string
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from enum import Enum
-from functools import reduce
-from typing import Dict
+from typing import Dict, Union
 
 from jinja2 import Template
 from telegram import User
 
 from ..data import Boss, Gym
 
+# The template is compiled once
+_TEMPLATE = Template(
+    "{% if is_ended %}\U0001F3C1*ENDED*\U0001F3C1\n{% endif %}"
+    "{% if raid.is_ex %}*EX*{% endif %}"
+    "{% if raid.gym.latitude is not none and raid.gym.longitude is not none %}"
+        "[{{ raid.gym.name|wordwrap(25) }}](http://maps.google.com/maps?"
+        "q={{ raid.gym.latitude }},{{ raid.gym.longitude }}"
+        "&ll={{ raid.gym.latitude }},{{ raid.gym.longitude }}"
+        "&z=17)\n"
+    "{% else %}"
+        "{{ raid.gym.name|wordwrap(25) }}\n"
+    "{% endif %}"
+    "\n"
+    "{% if raid.boss is not none %}"
+        "{% if raid.boss.is_there_shiny %}"
+            "\U00002728*{{ raid.boss.name }}*\U00002728\n"
+        "{% else %}"
+            "*{{ raid.boss.name }}*\n"
+        "{% endif %}"
+    "{% endif %}"
+    "{% if raid.effective_level is not none %}"
+        "{% for i in range(0, raid.effective_level) %}\U00002B50{% endfor %}\n"
+    "{% endif %}"
+    "\n"
+    "{% if raid.hatching is not none %}"
+        "`Hatching:   {% if raid.is_aprx_time %}~{% endif %}{{ raid.hatching.strftime('%H:%M') }}`\n"
+    "{% endif %}"
+    "{% if raid.end is not none %}"
+        "`End:        {% if raid.is_aprx_time %}~{% endif %}{{ raid.end.strftime('%H:%M') }}`\n"
+    "{% endif %}"
+    "{% if raid.hangout is not none %}"
+        "`Hangout:    {% if raid.is_aprx_time %} {% endif %}{{ raid.hangout.strftime('%H:%M') }}`\n"
+    "{% endif %}"
+    "{% if raid.participants|count > 0 %}"
+        "`─────────────────────`\n"
+        "{% for id, p in raid.participants.items() %}"
+            "[{{ p.name }}](tg://user?id={{ id }})"
+            "{% if p.is_remote %}\U0001F3E1{% endif %}"
+            "{% if p.is_flyer %}\U00002708{% endif %}"
+            "{% if p.number > 1 %} +{{ p.number - 1 }} {% endif %}"
+            "\n"
+        "{% endfor %}"
+        "`─────────────────────`\n"
+        "*{{ raid.participants_count }}* participants\n"
+    "{% endif %}"
+    "`[{{ raid.code }}]`"
+)
+
+# Last rendered messages by the state of their raid
+_RENDERED: OrderedDict = OrderedDict()
+_RENDERED_SIZE = 1024
+_RENDERED_LOCK = threading.Lock()
+
 
 @dataclass
 class Participant:
@@ -48,6 +102,8 @@ class Raid:
     hangout: datetime.time = None
     boss: Boss = None
     is_aprx_time: bool = False
+    chat_id: int = None
+    message_id: int = None
     participants: Dict[int, Participant] = field(default_factory=lambda: {})
 
     def add_participant(self, user: User) -> None:
@@ -83,9 +139,36 @@ class Raid:
             return True
         return False
 
+    def merge(self, other: Raid) -> bool:
+        """Completes the raid with the information of another screenshot of the same raid
+
+        It returns if something is changed.
+        """
+        changed = False
+
+        # A screenshot of the hatched raid tells the boss
+        if other.is_hatched and not self.is_hatched:
+            self.is_hatched = True
+            changed = True
+        if other.boss is not None and self.boss is None:
+            self.boss = other.boss
+            changed = True
+        if other.level is not None and self.level is None:
+            self.level = other.level
+            changed = True
+
+        # The times read from a screenshot are more accurate than the approximated ones
+        if self.is_aprx_time and not other.is_aprx_time:
+            self.end = other.end if other.end is not None else self.end
+            self.hatching = other.hatching if other.hatching is not None else self.hatching
+            self.is_aprx_time = False
+            changed = True
+
+        return changed
+
     @property
     def participants_count(self) -> int:
-        return reduce((lambda x, y: x + y), [p.number for _, p in self.participants.items()], 0)
+        return sum(p.number for p in self.participants.values())
 
     @property
     def effective_level(self) -> int:
@@ -94,51 +177,51 @@ class Raid:
                 return self.boss.level
         return self.level
 
-    def to_msg(self) -> str:
-        TEMPLATE = Template(
-            "{% if raid.is_ex %}*EX*{% endif %}"
-            "{% if raid.gym.latitude is not none and raid.gym.longitude is not none %}"
-                "[{{ raid.gym.name|wordwrap(25) }}](http://maps.google.com/maps?"
-                "q={{ raid.gym.latitude }},{{ raid.gym.longitude }}"
-                "&ll={{ raid.gym.latitude }},{{ raid.gym.longitude }}"
-                "&z=17)\n"
-            "{% else %}"
-                "{{ raid.gym.name|wordwrap(25) }}\n"
-            "{% endif %}"
-            "\n"
-            "{% if raid.boss is not none %}"
-                "{% if raid.boss.is_there_shiny %}"
-                    "\U00002728*{{ raid.boss.name }}*\U00002728\n"
-                "{% else %}"
-                    "*{{ raid.boss.name }}*\n"
-                "{% endif %}"
-            "{% endif %}"
-            "{% if raid.effective_level is not none %}"
-                "{% for i in range(0, raid.effective_level) %}\U00002B50{% endfor %}\n"
-            "{% endif %}"
-            "\n"
-            "{% if raid.hatching is not none %}"
-                "`Hatching:   {% if raid.is_aprx_time %}~{% endif %}{{ raid.hatching.strftime('%H:%M') }}`\n"
-            "{% endif %}"
-            "{% if raid.end is not none %}"
-                "`End:        {% if raid.is_aprx_time %}~{% endif %}{{ raid.end.strftime('%H:%M') }}`\n"
-            "{% endif %}"
-            "{% if raid.hangout is not none %}"
-                "`Hangout:    {% if raid.is_aprx_time %} {% endif %}{{ raid.hangout.strftime('%H:%M') }}`\n"
-            "{% endif %}"
-            "{% if raid.participants|count > 0 %}"
-                "`─────────────────────`\n"
-                "{% for id, p in raid.participants.items() %}"
-                    "[{{ p.name }}](tg://user?id={{ id }})"
-                    "{% if p.is_remote %}\U0001F3E1{% endif %}"
-                    "{% if p.is_flyer %}\U00002708{% endif %}"
-                    "{% if p.number > 1 %} +{{ p.number - 1 }} {% endif %}"
-                    "\n"
-                "{% endfor %}"
-                "`─────────────────────`\n"
-                "*{{ raid.participants_count }}* participants\n"
-            "{% endif %}"
-            "`[{{ raid.code }}]`"
-        )
-
-        return TEMPLATE.render(raid=self)
+    def end_datetime(self, now: datetime.datetime = None) -> Union[datetime.datetime, None]:
+        return Raid._next_datetime(self.end, now)
+
+    def hangout_datetime(self, now: datetime.datetime = None) -> Union[datetime.datetime, None]:
+        return Raid._next_datetime(self.hangout, now)
+
+    @staticmethod
+    def _next_datetime(t: Union[datetime.time, None],
+                       now: Union[datetime.datetime, None]) -> Union[datetime.datetime, None]:
+        """Returns the next occurrence of the time, a time passed less than an hour ago is still today"""
+        if t is None:
+            return None
+
+        now = now if now is not None else datetime.datetime.now()
+
+        result = datetime.datetime.combine(now.date(), t)
+        if result < now - datetime.timedelta(hours=1):
+            result += datetime.timedelta(days=1)
+
+        return result
+
+    def _state(self) -> tuple:
+        """Returns everything that is shown in the message"""
+        gym = (self.gym.name, self.gym.latitude, self.gym.longitude) if self.gym is not None else None
+        boss = (self.boss.name, self.boss.level, self.boss.is_there_shiny) if self.boss is not None else None
+
+        return (self.code, gym, self.is_ex, self.level, boss, self.hatching, self.end, self.hangout,
+                self.is_aprx_time, tuple((p.id, p.name, p.type, p.number) for p in self.participants.values()))
+
+    def to_msg(self, is_ended: bool = False) -> str:
+        state = (self._state(), is_ended)
+
+        # Renders the message only if the same state wasn't already rendered
+        with _RENDERED_LOCK:
+            try:
+                _RENDERED.move_to_end(state)
+                return _RENDERED[state]
+            except KeyError:
+                pass
+
+        msg = _TEMPLATE.render(raid=self, is_ended=is_ended)
+
+        with _RENDERED_LOCK:
+            _RENDERED[state] = msg
+            if len(_RENDERED) > _RENDERED_SIZE:
+                _RENDERED.popitem(last=False)
+
+        return msg
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import datetime
+from typing import Any, Dict, Union
+
+import msgpack
+
+from . import Participant, Raid
+from ..data import Boss, Gym
+
+# Version of the encoding, it must be increased every time the layout changes
+VERSION = 1
+
+# Keys of the fields in the encoded raid
+# A missing key means that the field has its default value
+KEY_VERSION = 0
+KEY_CODE = 1
+KEY_GYM = 2
+KEY_IS_EX = 3
+KEY_LEVEL = 4
+KEY_IS_HATCHED = 5
+KEY_END = 6
+KEY_HATCHING = 7
+KEY_HANGOUT = 8
+KEY_BOSS = 9
+KEY_IS_APRX_TIME = 10
+KEY_PARTICIPANTS = 11
+KEY_CHAT_ID = 12
+KEY_MESSAGE_ID = 13
+
+
+class InvalidRaid(Exception):
+    pass
+
+
+def _items(value: Union[list, dict], n: int) -> list:
+    """Returns the n items of an encoded array
+
+    After an edit by a Lua script an array with missing items becomes a map of 1-based indexes.
+    """
+    if isinstance(value, dict):
+        return [value.get(i + 1) for i in range(n)]
+    return list(value) + [None] * (n - len(value))
+
+
+def encode_time(t: Union[datetime.time, None]) -> Union[int, None]:
+    """Encodes a time as seconds from the midnight"""
+    if t is None:
+        return None
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def decode_time(t: Union[int, None]) -> Union[datetime.time, None]:
+    if t is None:
+        return None
+    return datetime.time(t // 3600, t // 60 % 60, t % 60)
+
+
+def encode_gym(gym: Union[Gym, None]) -> Union[list, None]:
+    if gym is None:
+        return None
+    return [gym.name, gym.latitude, gym.longitude]
+
+
+def decode_gym(gym: Union[list, None]) -> Union[Gym, None]:
+    if gym is None:
+        return None
+
+    name, latitude, longitude = _items(gym, 3)
+
+    # A Lua script stores the integral numbers as integers
+    return Gym(name,
+               float(latitude) if latitude is not None else None,
+               float(longitude) if longitude is not None else None)
+
+
+def encode_boss(boss: Union[Boss, None]) -> Union[list, None]:
+    if boss is None:
+        return None
+    return [boss.name, boss.level, boss.is_there_shiny]
+
+
+def decode_boss(boss: Union[list, None]) -> Union[Boss, None]:
+    if boss is None:
+        return None
+    name, level, is_there_shiny = _items(boss, 3)
+    return Boss(name, level, bool(is_there_shiny))
+
+
+def encode_participant(participant: Participant) -> list:
+    return [participant.id, participant.name, participant.type.value, participant.number]
+
+
+def decode_participant(participant: list) -> Participant:
+    id_, name, type_, number = _items(participant, 4)
+    return Participant(id_, name, Participant.Type(type_), number)
+
+
+def encode_participant_entry(participant: Participant, seq: int) -> bytes:
+    """Encodes a participant as a value of the Redis hash of the participants of a raid"""
+    return msgpack.packb([participant.name, participant.type.value, participant.number, seq])
+
+
+def decode_participants(entries: Dict[bytes, bytes]) -> Dict[int, Participant]:
+    """Decodes the Redis hash of the participants of a raid, keeping the order in which they joined"""
+    participants = []
+    try:
+        for k, v in entries.items():
+            # Skips the fields that are not user ids (e.g. the counter of the joins)
+            if not k.isdigit():
+                continue
+
+            name, type_, number, seq = msgpack.unpackb(v)
+            participants.append((seq, Participant(int(k), name, Participant.Type(type_), number)))
+
+    except (ValueError, TypeError):
+        raise InvalidRaid
+
+    participants.sort(key=lambda x: x[0])
+
+    return {p.id: p for _, p in participants}
+
+
+def encode(raid: Raid) -> bytes:
+    fields = {
+        KEY_VERSION: VERSION,
+        KEY_CODE: raid.code,
+        KEY_GYM: encode_gym(raid.gym),
+        KEY_IS_EX: raid.is_ex,
+        KEY_LEVEL: raid.level,
+        KEY_IS_HATCHED: raid.is_hatched,
+        KEY_END: encode_time(raid.end),
+        KEY_HATCHING: encode_time(raid.hatching),
+        KEY_HANGOUT: encode_time(raid.hangout),
+        KEY_BOSS: encode_boss(raid.boss),
+        KEY_IS_APRX_TIME: raid.is_aprx_time,
+        KEY_PARTICIPANTS: [encode_participant(p) for p in raid.participants.values()],
+        KEY_CHAT_ID: raid.chat_id,
+        KEY_MESSAGE_ID: raid.message_id
+    }
+
+    # Omits the fields with the default value
+    return msgpack.packb({k: v for k, v in fields.items() if v is not None and v is not False and v != []})
+
+
+def decode(data: bytes) -> Raid:
+    try:
+        fields: Dict[int, Any] = msgpack.unpackb(data, strict_map_key=False)
+
+        if fields[KEY_VERSION] != VERSION:
+            raise InvalidRaid
+
+        raid = Raid(code=fields[KEY_CODE],
+                    gym=decode_gym(fields.get(KEY_GYM)),
+                    is_ex=fields.get(KEY_IS_EX, False),
+                    level=fields.get(KEY_LEVEL),
+                    is_hatched=fields.get(KEY_IS_HATCHED, False),
+                    end=decode_time(fields.get(KEY_END)),
+                    hatching=decode_time(fields.get(KEY_HATCHING)),
+                    hangout=decode_time(fields.get(KEY_HANGOUT)),
+                    boss=decode_boss(fields.get(KEY_BOSS)),
+                    is_aprx_time=fields.get(KEY_IS_APRX_TIME, False),
+                    chat_id=fields.get(KEY_CHAT_ID),
+                    message_id=fields.get(KEY_MESSAGE_ID))
+
+        for p in fields.get(KEY_PARTICIPANTS, []):
+            p = decode_participant(p)
+            raid.participants[p.id] = p
+
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise InvalidRaid
+
+    return raid
+
+
+def is_legacy(data: bytes) -> bool:
+    """Checks if the data is a raid stored with pickle by the older versions"""
+    # An encoded raid is a map with at least two entries, so it never begins as a pickle
+    return data[:1] == b"\x80"
@@ -0,0 +1,545 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import logging
+import pickle
+import time
+from typing import Any, Dict, List, Tuple, Union
+
+import msgpack
+from redis import StrictRedis
+from redis.client import Pipeline
+
+from .. import redis_keys
+from ..data import Boss
+from ..metrics import metrics
+from ..raid import Raid, codec
+
+_LOGGER = logging.getLogger(__package__)
+
+# Changes a participant of a raid, the participants expire with the raid
+# KEYS: raid, participants
+# ARGV: user id, user full name, operation (a|r|h|f)
+# Returns {status, raid, participants}, the status is UNCHANGED or CHANGED
+# A participant is stored as msgpack [name, type, number, seq]
+_UPDATE_PARTICIPANT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {%(RAID_NOT_FOUND)d}
+end
+
+local op = ARGV[3]
+local status = %(UNCHANGED)d
+local value = redis.call('HGET', KEYS[2], ARGV[1])
+
+if op == 'a' then
+    if value then
+        local p = cmsgpack.unpack(value)
+        p[1] = ARGV[2]
+        p[3] = p[3] + 1
+        redis.call('HSET', KEYS[2], ARGV[1], cmsgpack.pack(p))
+    else
+        local seq = redis.call('HINCRBY', KEYS[2], 'seq', 1)
+        redis.call('HSET', KEYS[2], ARGV[1], cmsgpack.pack({ARGV[2], 1, 1, seq}))
+    end
+    status = %(CHANGED)d
+
+elseif value then
+    local p = cmsgpack.unpack(value)
+    p[1] = ARGV[2]
+
+    if op == 'r' then
+        p[3] = p[3] - 1
+    elseif op == 'h' then
+        p[2] = (p[2] == 2) and 1 or 2
+    elseif op == 'f' then
+        p[2] = (p[2] == 3) and 1 or 3
+    end
+
+    if p[3] > 0 then
+        redis.call('HSET', KEYS[2], ARGV[1], cmsgpack.pack(p))
+    else
+        redis.call('HDEL', KEYS[2], ARGV[1])
+    end
+    status = %(CHANGED)d
+end
+
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl > 0 then
+    redis.call('PEXPIRE', KEYS[2], ttl)
+end
+
+return {status, redis.call('GET', KEYS[1]), redis.call('HGETALL', KEYS[2])}
+"""
+
+# Sets some fields of an encoded raid keeping its expiration
+# KEYS: raid, participants
+# ARGV: pairs of key of the field and msgpack encoded value
+# Returns {status, raid, participants}, the status is CHANGED
+_SET_FIELD = """
+local raid = redis.call('GET', KEYS[1])
+if not raid then
+    return {%(RAID_NOT_FOUND)d}
+end
+
+raid = cmsgpack.unpack(raid)
+for i = 1, #ARGV, 2 do
+    raid[tonumber(ARGV[i])] = cmsgpack.unpack(ARGV[i + 1])
+end
+raid = cmsgpack.pack(raid)
+
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl > 0 then
+    redis.call('SET', KEYS[1], raid, 'PX', ttl)
+else
+    redis.call('SET', KEYS[1], raid)
+end
+
+return {%(CHANGED)d, raid, redis.call('HGETALL', KEYS[2])}
+"""
+
+# Moves the due events to the events in progress and returns them, so every event is handled by a single process
+# The events in progress for too long were taken by a process that stopped, so they are due again
+# KEYS: schedule, events in progress
+# ARGV: timestamp, maximum number of events, timestamp before which an event in progress is stuck
+_POP_DUE = """
+local stuck = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+for _, e in ipairs(stuck) do
+    redis.call('ZADD', KEYS[1], 'NX', ARGV[1], e)
+    redis.call('ZREM', KEYS[2], e)
+end
+
+local events = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, e in ipairs(events) do
+    redis.call('ZADD', KEYS[2], ARGV[1], e)
+end
+if #events > 0 then
+    redis.call('ZREM', KEYS[1], unpack(events))
+end
+return events
+"""
+
+# Finds a raid of the same gym that ends at about the same time, otherwise saves and indexes the raid
+# The raid is saved with its indexes, so a raid found by another process always exists
+# KEYS: raids of the gym in the chat, raid, participants, raids of the chat, schedule, post claim
+# ARGV: minimum end, maximum end, code, end, timestamp, expiration of the indexes in seconds,
+#       encoded raid, expiration timestamp of the raid, end event, post claim timeout in milliseconds
+# Returns the code of the duplicate or nil
+_SAVE_UNIQUE = """
+local found = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[2], 'LIMIT', 0, 1)
+if #found > 0 then
+    return found[1]
+end
+
+redis.call('SET', KEYS[2], ARGV[7])
+redis.call('EXPIREAT', KEYS[2], ARGV[8])
+redis.call('EXPIREAT', KEYS[3], ARGV[8])
+
+for _, index in ipairs({KEYS[1], KEYS[4]}) do
+    redis.call('ZREMRANGEBYSCORE', index, '-inf', ARGV[5])
+    redis.call('ZADD', index, ARGV[4], ARGV[3])
+    redis.call('EXPIRE', index, ARGV[6])
+end
+
+redis.call('ZADD', KEYS[5], ARGV[4], ARGV[9])
+
+-- The process that saves the raid posts it
+redis.call('SET', KEYS[6], 1, 'PX', ARGV[10])
+
+return false
+"""
+
+# Events of the schedule
+END = "end"
+REMIND = "remind"
+
+# Seconds after which an event in progress is considered lost and it is due again
+IN_PROGRESS_TIMEOUT = 60 * 10
+
+# Seconds after which a post that isn't completed can be tried by another process
+POST_CLAIM_TIMEOUT = 60
+
+# Status returned by the scripts
+RAID_NOT_FOUND = -1
+UNCHANGED = 0
+CHANGED = 1
+
+_STATUS = {
+    "RAID_NOT_FOUND": RAID_NOT_FOUND,
+    "UNCHANGED": UNCHANGED,
+    "CHANGED": CHANGED
+}
+
+
+class RaidNotFound(Exception):
+    pass
+
+
+class RaidStore:
+    """Storage of the raids in Redis
+
+    The raid is stored as a string encoded with the codec, while its participants are kept
+    in a separate hash, so every participant can be changed atomically.
+    Most updates are done in a single round trip by a pipeline or a Lua script, merging a raid and
+    setting a hangout with a reminder take two. The metric raidstore.round_trips.<method> observes
+    the round trips of every call.
+
+    The end of a raid and the reminder before its hangout are events of a sorted set scored
+    by their timestamp, so they are shared by all the processes and survive the restarts.
+    A raid expires a grace period after its end or, if its end is unknown, after the expiration.
+    """
+
+    def __init__(self, redis: StrictRedis, expiration: int, grace: int, reminder: int):
+        self._redis = redis
+        self._expiration = expiration
+        self._grace = grace
+        self._reminder = reminder
+
+        self._update_participant = self._redis.register_script(_UPDATE_PARTICIPANT % _STATUS)
+        self._set_field = self._redis.register_script(_SET_FIELD % _STATUS)
+        self._pop_due = self._redis.register_script(_POP_DUE)
+        self._save_unique = self._redis.register_script(_SAVE_UNIQUE)
+
+    def get(self, code: str) -> Raid:
+        metrics.observe("raidstore.round_trips.get")
+
+        return self._get(code)
+
+    def _get(self, code: str) -> Raid:
+        pipe = self._redis.pipeline()
+        pipe.get(redis_keys.RAID.format(code))
+        pipe.hgetall(redis_keys.PARTICIPANTS.format(code))
+        data, participants = pipe.execute()
+
+        if data is None:
+            raise RaidNotFound
+
+        return self._decode(data, participants)
+
+    def save(self, raid: Raid) -> None:
+        """Saves the raid, its participants are left untouched
+
+        A raid of a chat is also added to the index of the active raids of that chat,
+        and its end is scheduled.
+        """
+        pipe = self._redis.pipeline()
+        pipe.set(redis_keys.RAID.format(raid.code), codec.encode(raid))
+        self._schedule(pipe, raid)
+        pipe.execute()
+
+        metrics.observe("raidstore.round_trips.save")
+
+    def set_merged(self, raid: Raid) -> Raid:
+        """Writes the fields completed by the screenshots of the same raid, the others are left untouched
+
+        A merge only completes a raid, so only the fields that are known are written.
+        The end could be changed, so it is scheduled again.
+        """
+        fields = {}
+        if raid.is_hatched:
+            fields[codec.KEY_IS_HATCHED] = True
+        if raid.boss is not None:
+            fields[codec.KEY_BOSS] = codec.encode_boss(raid.boss)
+        if raid.level is not None:
+            fields[codec.KEY_LEVEL] = raid.level
+        if not raid.is_aprx_time:
+            fields[codec.KEY_END] = codec.encode_time(raid.end)
+            fields[codec.KEY_HATCHING] = codec.encode_time(raid.hatching)
+            fields[codec.KEY_IS_APRX_TIME] = False
+
+        raid = self._set(raid.code, fields)
+
+        pipe = self._redis.pipeline()
+        self._schedule(pipe, raid)
+        pipe.execute()
+
+        metrics.observe("raidstore.round_trips.set_merged", 2)
+
+        return raid
+
+    def _schedule(self, pipe: Pipeline, raid: Raid) -> None:
+        """Adds to the pipeline the expiration, the indexes and the end event of the raid"""
+        now = time.time()
+        end = self._end(raid, now)
+        expire_at = int(end) + self._grace
+
+        pipe.expireat(redis_keys.RAID.format(raid.code), expire_at)
+        pipe.expireat(redis_keys.PARTICIPANTS.format(raid.code), expire_at)
+
+        if raid.chat_id is not None:
+            index = redis_keys.CHAT_RAIDS.format(raid.chat_id)
+
+            # Removes the raids already ended
+            pipe.zremrangebyscore(index, "-inf", now)
+            pipe.zadd(index, {raid.code: end})
+            pipe.expire(index, self._expiration + self._grace)
+
+            pipe.zadd(redis_keys.SCHEDULE, {"{}:{}".format(END, raid.code): end})
+
+            if raid.gym is not None:
+                pipe.zadd(self._gym_key(raid), {raid.code: end})
+                pipe.expire(self._gym_key(raid), self._expiration + self._grace)
+
+    def save_unique(self, raid: Raid, tolerance: int) -> Union[Raid, None]:
+        """Saves the raid, unless an active raid of the same chat and gym ends within the tolerance in seconds
+
+        The duplicate is returned instead. If the raid is saved, the caller holds the claim to post it.
+        """
+        if raid.chat_id is None or raid.gym is None:
+            self.save(raid)
+            return None
+
+        round_trips = 0
+        try:
+            while True:
+                now = time.time()
+                end = self._end(raid, now)
+
+                code = self._save_unique(keys=[self._gym_key(raid), *self._keys(raid.code),
+                                               redis_keys.CHAT_RAIDS.format(raid.chat_id), redis_keys.SCHEDULE,
+                                               redis_keys.POST_CLAIM.format(raid.code)],
+                                         args=[end - tolerance, end + tolerance, raid.code, end, now,
+                                               self._expiration + self._grace, codec.encode(raid),
+                                               int(end) + self._grace, "{}:{}".format(END, raid.code),
+                                               POST_CLAIM_TIMEOUT * 1000])
+                round_trips += 1
+
+                if code is None:
+                    return None
+
+                try:
+                    round_trips += 1
+                    return self._get(code.decode())
+                except RaidNotFound:
+                    # The duplicate is deleted in the meantime, so it is removed from the index and the raid
+                    # is tried again
+                    self._redis.zrem(self._gym_key(raid), code)
+                    round_trips += 1
+        finally:
+            metrics.observe("raidstore.round_trips.save_unique", round_trips)
+
+    def claim_post(self, code: str) -> bool:
+        """Claims the post of a raid that has no message, so only a process posts it"""
+        metrics.observe("raidstore.round_trips.claim_post")
+
+        return bool(self._redis.set(redis_keys.POST_CLAIM.format(code), 1, nx=True, px=POST_CLAIM_TIMEOUT * 1000))
+
+    def release_post(self, code: str) -> None:
+        """Releases the claim after a failed post, so the raid can be posted again"""
+        self._redis.delete(redis_keys.POST_CLAIM.format(code))
+
+        metrics.observe("raidstore.round_trips.release_post")
+
+    def active(self, chat_id: int) -> List[Raid]:
+        """Returns the raids of the chat that are not ended yet, sorted by their end"""
+        index = redis_keys.CHAT_RAIDS.format(chat_id)
+        now = time.time()
+
+        pipe = self._redis.pipeline()
+        pipe.zremrangebyscore(index, "-inf", now)
+        pipe.zrangebyscore(index, now, "+inf")
+        codes = [c.decode() for c in pipe.execute()[1]]
+
+        if len(codes) == 0:
+            metrics.observe("raidstore.round_trips.active")
+            return []
+
+        pipe = self._redis.pipeline(transaction=False)
+        for code in codes:
+            pipe.get(redis_keys.RAID.format(code))
+            pipe.hgetall(redis_keys.PARTICIPANTS.format(code))
+        results = pipe.execute()
+
+        raids = []
+        missing = []
+        for code, data, participants in zip(codes, results[::2], results[1::2]):
+            # The raid could be expired before its end
+            if data is None:
+                missing.append(code)
+                continue
+
+            try:
+                raids.append(self._decode(data, participants))
+            except codec.InvalidRaid:
+                _LOGGER.warning("The raid {} is invalid".format(code))
+
+        if len(missing) > 0:
+            self._redis.zrem(index, *missing)
+
+        metrics.observe("raidstore.round_trips.active", 3 if len(missing) > 0 else 2)
+
+        return raids
+
+    def update_participant(self, code: str, user_id: int, name: str, op: str) -> Tuple[bool, Raid]:
+        """Applies the operation (a: add, r: remove, h: toggle remote, f: toggle flyer) to the participant
+
+        It returns if the participant is changed and the updated raid.
+        """
+        result = self._update_participant(keys=self._keys(code), args=[user_id, name, op])
+
+        metrics.observe("raidstore.round_trips.update_participant")
+
+        return self._result(result)
+
+    def set_hangout(self, code: str, hangout: datetime.time) -> Raid:
+        """Sets the hangout and schedules the reminder for the participants"""
+        raid = self._set(code, {codec.KEY_HANGOUT: codec.encode_time(hangout)})
+
+        # A hangout already passed has nothing to remind
+        hangout = raid.hangout_datetime().timestamp()
+        if raid.chat_id is not None and hangout > time.time():
+            self._redis.zadd(redis_keys.SCHEDULE, {"{}:{}".format(REMIND, raid.code): hangout - self._reminder})
+
+            metrics.observe("raidstore.round_trips.set_hangout", 2)
+        else:
+            metrics.observe("raidstore.round_trips.set_hangout")
+
+        return raid
+
+    def set_message(self, code: str, message_id: int) -> Raid:
+        """Sets the message that shows the raid"""
+        metrics.observe("raidstore.round_trips.set_message")
+
+        return self._set(code, {codec.KEY_MESSAGE_ID: message_id})
+
+    def set_boss(self, code: str, boss: Boss) -> Raid:
+        metrics.observe("raidstore.round_trips.set_boss")
+
+        return self._set(code, {codec.KEY_BOSS: codec.encode_boss(boss)})
+
+    def _set(self, code: str, fields: Dict[int, Any]) -> Raid:
+        args = []
+        for key, value in fields.items():
+            args += [key, msgpack.packb(value)]
+
+        result = self._set_field(keys=self._keys(code), args=args)
+
+        return self._result(result)[1]
+
+    def delete(self, raid: Raid) -> None:
+        """Deletes the raid and its events"""
+        pipe = self._redis.pipeline()
+        pipe.delete(*self._keys(raid.code))
+        if raid.chat_id is not None:
+            pipe.zrem(redis_keys.CHAT_RAIDS.format(raid.chat_id), raid.code)
+            if raid.gym is not None:
+                pipe.zrem(self._gym_key(raid), raid.code)
+        pipe.zrem(redis_keys.SCHEDULE, *("{}:{}".format(e, raid.code) for e in (END, REMIND)))
+        pipe.execute()
+
+        metrics.observe("raidstore.round_trips.delete")
+
+    def pop_due(self, limit: int = 10) -> List[Tuple[str, str]]:
+        """Takes the events that are due, as (event, code)
+
+        They stay in progress until they are marked as done, otherwise they are due again after a timeout.
+        """
+        now = time.time()
+        events = self._pop_due(keys=[redis_keys.SCHEDULE, redis_keys.SCHEDULE_IN_PROGRESS],
+                               args=[now, limit, now - IN_PROGRESS_TIMEOUT])
+
+        metrics.observe("raidstore.round_trips.pop_due")
+
+        return [tuple(e.decode().split(":", 1)) for e in events]
+
+    def done(self, event: str, code: str) -> None:
+        """Marks as handled an event taken by pop_due"""
+        self._redis.zrem(redis_keys.SCHEDULE_IN_PROGRESS, "{}:{}".format(event, code))
+
+        metrics.observe("raidstore.round_trips.done")
+
+    def pending(self) -> int:
+        """Returns the number of the scheduled events"""
+        return self._redis.zcard(redis_keys.SCHEDULE)
+
+    def _end(self, raid: Raid, now: float) -> float:
+        """Returns the end timestamp of the raid, a raid can't last longer than it is stored"""
+        end = raid.end_datetime()
+        return min(end.timestamp(), now + self._expiration) if end is not None else now + self._expiration
+
+    @staticmethod
+    def _gym_key(raid: Raid) -> str:
+        return redis_keys.CHAT_GYM_RAIDS.format(raid.chat_id, hashlib.sha1(raid.gym.name.encode()).hexdigest()[:16])
+
+    @staticmethod
+    def _keys(code: str) -> List[str]:
+        return [redis_keys.RAID.format(code), redis_keys.PARTICIPANTS.format(code)]
+
+    @classmethod
+    def _result(cls, result: list) -> Tuple[bool, Raid]:
+        if result[0] == RAID_NOT_FOUND:
+            raise RaidNotFound
+
+        status, data, participants = result
+
+        return status == CHANGED, cls._decode(data, dict(zip(participants[::2], participants[1::2])))
+
+    @staticmethod
+    def _decode(data: bytes, participants: dict) -> Raid:
+        raid = codec.decode(data)
+        raid.participants.update(codec.decode_participants(participants))
+        return raid
+
+    def migrate(self) -> None:
+        """Converts the raids stored by the older versions
+
+        They could be stored with pickle and with the participants inside the raid.
+        The migration runs once for every version of the codec.
+        """
+        if int(self._redis.get(redis_keys.MIGRATED) or 0) >= codec.VERSION:
+            return
+
+        migrated = 0
+        for key in self._redis.scan_iter(match=redis_keys.RAID.format("*"), count=1000):
+            data = self._redis.get(key)
+            if data is None:
+                continue
+
+            if codec.is_legacy(data):
+                try:
+                    raid = pickle.loads(data)
+                except Exception:
+                    # Nobody can read it
+                    _LOGGER.warning("Unable to unpickle {}, it is deleted".format(key))
+                    self._redis.delete(key)
+                    continue
+            else:
+                try:
+                    raid = codec.decode(data)
+                except codec.InvalidRaid:
+                    # It could be written by a newer version
+                    _LOGGER.warning("Unable to decode {}, it is skipped".format(key))
+                    continue
+
+                if len(raid.participants) == 0:
+                    continue
+
+            ttl = self._redis.pttl(key)
+            if ttl <= 0:
+                continue
+
+            participants = raid.participants
+            raid.participants = {}
+
+            try:
+                data = codec.encode(raid)
+            except (AttributeError, TypeError, ValueError):
+                _LOGGER.warning("Unable to migrate {}, it is skipped".format(key))
+                continue
+
+            pipe = self._redis.pipeline()
+            pipe.psetex(key, ttl, data)
+            if len(participants) > 0:
+                pipe.hset(redis_keys.PARTICIPANTS.format(raid.code), "seq", len(participants))
+                for seq, p in enumerate(participants.values(), 1):
+                    pipe.hset(redis_keys.PARTICIPANTS.format(raid.code), p.id,
+                              codec.encode_participant_entry(p, seq))
+                pipe.pexpire(redis_keys.PARTICIPANTS.format(raid.code), ttl)
+            pipe.execute()
+
+            migrated += 1
+
+        if migrated > 0:
+            _LOGGER.info("{} raids were migrated to the new format".format(migrated))
+
+        self._redis.set(redis_keys.MIGRATED, codec.VERSION)
@@ -4,5 +4,29 @@ SUPERADMIN = CONFIG.format("superadmin")
 ADMIN = CONFIG.format("admin")
 DISABLEDSCAN = CONFIG.format("disablescan")
 ENABLEDCHAT = CONFIG.format("enabledchat")
+# Version of the codec to which the stored raids were migrated
+MIGRATED = CONFIG.format("migrated")
 
-RAID = "raid:{}"
\ No newline at end of file
+# Channel where the changes of the configuration are announced
+INVALIDATE = CONFIG.format("invalidate")
+
+RAID = "raid:{}"
+PARTICIPANTS = "participants:{}"
+# Claim of the process that is posting a raid
+POST_CLAIM = "post:{}"
+
+# Codes of the active raids of a chat scored by their end timestamp
+CHAT_RAIDS = "chat:{}:raids"
+# Codes of the active raids of a gym in a chat scored by their end timestamp
+CHAT_GYM_RAIDS = "chat:{}:gym:{}:raids"
+# Id of the pinned message of a chat
+CHAT_PINNED = "chat:{}:pinned"
+
+# Due events of the raids (e.g. end:{code}) scored by their timestamp
+SCHEDULE = "schedule"
+# Due events that are being handled scored by the timestamp when they were taken
+SCHEDULE_IN_PROGRESS = "schedule:inprogress"
+
+# Streams of the screenshots to analyze and of the raids found by the workers
+OCR_JOBS = "ocr:jobs"
+OCR_RESULTS = "ocr:results"
\ No newline at end of file
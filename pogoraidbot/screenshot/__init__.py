@@ -230,7 +230,7 @@ class ScreenshotRaid:
             raise BossesListNotAvailable
 
         # Force the calc of the level if it isn't already calculated
-        _ = self.level
+        level = self.level
 
         # Calculate the subset based on the level position
         try:
@@ -256,13 +256,16 @@ class ScreenshotRaid:
         text = text.rstrip().replace('\n', ' ')
         text = " ".join(text.split())
 
-        # Try to find a boss from text
-        b = bosses.find(text)
+        # Try to find a boss from text between the ones of the same level
+        b, partition = bosses.find_by_level(text, level)
 
         # Check if a valid boss was found
         if b is None:
             raise BossNotFound
 
+        _LOGGER.debug("Boss found in the {} partition"
+                      .format("level {}".format(partition) if partition is not None else "whole list"))
+
         return b
 
     def _find_ex_tag(self) -> Rect:
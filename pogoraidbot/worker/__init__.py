@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import logging
+import sys
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from redis import StrictRedis, exceptions
+from redis.client import Pipeline
+from telegram import Bot
+
+from .. import redis_keys
+from ..data import add_reload_job, bosses, gyms
+from ..metrics import metrics
+from ..ocrqueue import StreamConsumer, JOBS_GROUP, push
+from ..raid import codec
+from ..screenshot import ScreenshotRaid
+
+_LOGGER = logging.getLogger(__package__)
+
+# Minutes between two logs of the metrics
+METRICS_INTERVAL = 15
+
+
+class OCRWorker:
+    """Process that analyzes the screenshots pushed by the bots
+
+    The screenshots are taken from the stream of the jobs, shared by all the workers,
+    and the raids that are found are pushed to the stream of the results.
+    """
+
+    def __init__(self,
+                 token: str,
+                 redis: str = "redis://127.0.0.1:6379/0",
+                 bosses_file: str = None,
+                 bosses_expiration: int = 12,
+                 gyms_file: str = None,
+                 gyms_expiration: int = 12,
+                 cache_folder: str = None
+                 ):
+        # Init and test redis connection
+        self._redis = StrictRedis.from_url(url=redis, charset="utf-8", decode_responses=False)
+
+        _LOGGER.info("Try to connect to Redis...")
+        try:
+            self._redis.ping()
+        except exceptions.ConnectionError:
+            _LOGGER.critical("Unable to connect to Redis")
+            sys.exit()
+        _LOGGER.info("Successfully connected to Redis")
+
+        # Init the bot, it is used only to download the screenshots
+        self._bot = Bot(token)
+
+        # Creates background scheduler for update the lists
+        self._scheduler = BackgroundScheduler(daemon=True)
+
+        # Creates job to update bosses list
+        if bosses_file is not None:
+            bosses.load_from(bosses_file, cache_folder)
+            add_reload_job(self._scheduler, lambda: bosses.load_from(bosses_file, cache_folder),
+                           bosses_file, bosses_expiration)
+
+        # Creates job to update gyms list
+        if gyms_file is not None:
+            gyms.load_from(gyms_file, cache_folder)
+            add_reload_job(self._scheduler, lambda: gyms.load_from(gyms_file, cache_folder), gyms_file, gyms_expiration)
+
+        # Creates job to log the metrics
+        self._scheduler.add_job(metrics.log, 'interval', minutes=METRICS_INTERVAL)
+
+        self._scheduler.start()
+
+        self._jobs = StreamConsumer(self._redis, redis_keys.OCR_JOBS, JOBS_GROUP, self._analyze)
+
+    def run(self) -> None:
+        _LOGGER.info("Worker ready")
+
+        self._jobs.run()
+
+    def _analyze(self, job: dict, pipe: Pipeline) -> None:
+        # Get the screenshot
+        img = self._bot.get_file(job[b"file_id"].decode()).download_as_bytearray()
+
+        # Load the screenshot
+        screen = ScreenshotRaid(img)
+
+        metrics.observe("worker.screenshots")
+
+        # Check if it's a screenshot of a raid
+        if not screen.is_raid:
+            return
+
+        _LOGGER.info("It's a valid screen of a raid")
+
+        # The result is pushed with the acknowledgement of the job
+        push(self._redis, redis_keys.OCR_RESULTS, {
+            "raid": codec.encode(screen.to_raid()),
+            "message": job[b"message"]
+        }, pipe)
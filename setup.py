@@ -27,7 +27,9 @@ setup(
         'requests ~= 2.22',
         'schema ~= 0.7',
         'apscheduler ~= 3.6',
-        'mpu ~= 0.23'
+        'mpu ~= 0.23',
+        'msgpack ~= 1.0',
+        'aiohttp ~= 3.6'
     ],
     classifiers=[
         'Development Status :: 4 - Beta',
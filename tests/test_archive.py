@@ -0,0 +1,79 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from pogoraidbot import archive
+from pogoraidbot.archive import Archive, InvalidGroup
+from pogoraidbot.data import Boss, Gym
+from pogoraidbot.raid import Participant, Raid
+
+# Noon of two days of two different months
+_MARCH = datetime.datetime(2024, 3, 31, 12).timestamp()
+_APRIL = datetime.datetime(2024, 4, 1, 12).timestamp()
+
+
+def _raid(gym: str, boss: str, chat_id: int = -1001, participants: int = 0) -> Raid:
+    raid = Raid(gym=Gym(gym), boss=Boss(boss, 5), level=5, chat_id=chat_id)
+    for i in range(participants):
+        raid.participants[i] = Participant(i, "P{}".format(i))
+    return raid
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.archive = Archive(self.folder)
+
+        self.archive.append(_raid("Fountain", "Mewtwo", participants=3), _MARCH)
+        self.archive.append(_raid("Fountain", "Lugia", participants=1), _MARCH + 60)
+        self.archive.append(_raid("Church", "Mewtwo", participants=5), _APRIL)
+        self.archive.append(_raid("Church", "Mewtwo", chat_id=-1002, participants=2), _APRIL + 60)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_aggregate(self):
+        self.assertEqual(self.archive.aggregate("boss", 0), [("Mewtwo", 3, 10), ("Lugia", 1, 1)])
+        self.assertEqual(self.archive.aggregate("gym", 0, chat_id=-1001), [("Fountain", 2, 4), ("Church", 1, 5)])
+        self.assertEqual(self.archive.aggregate("day", 0), [("2024-04-01", 2, 7), ("2024-03-31", 2, 4)])
+        self.assertEqual(self.archive.aggregate("level", _APRIL), [(5, 2, 7)])
+
+        with self.assertRaises(InvalidGroup):
+            self.archive.aggregate("chat", 0)
+
+    def test_segments(self):
+        self.archive.flush()
+
+        # A block never crosses two months
+        self.assertEqual(sorted(os.listdir(self.folder)), ["raids-2024-03.seg", "raids-2024-04.seg"])
+
+        # The raids are counted once, also after more flushes
+        self.archive.flush()
+        self.assertEqual(self.archive.aggregate("boss", 0, _MARCH + 60), [("Mewtwo", 1, 3), ("Lugia", 1, 1)])
+
+    def test_block_size(self):
+        with mock.patch.object(archive, "BLOCK_SIZE", 5):
+            self.archive.append(_raid("Fountain", "Mewtwo"), _APRIL + 120)
+
+            # The fifth raid writes the block
+            self.assertEqual(len(self.archive._buffer), 0)
+            self.assertEqual(self.archive.aggregate("boss", 0)[0], ("Mewtwo", 4, 10))
+
+    def test_truncated(self):
+        self.archive.flush()
+        self.archive.append(_raid("Fountain", "Mewtwo"), _APRIL + 120)
+        self.archive.flush()
+
+        path = os.path.join(self.folder, "raids-2024-04.seg")
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 4)
+
+        # The raids of the complete blocks are still counted
+        self.assertEqual(self.archive.aggregate("boss", 0), [("Mewtwo", 3, 10), ("Lugia", 1, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
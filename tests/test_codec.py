@@ -0,0 +1,86 @@
+import datetime
+import pickle
+import unittest
+
+import msgpack
+
+from pogoraidbot.data import Boss, Gym
+from pogoraidbot.raid import Participant, Raid
+from pogoraidbot.raid import codec
+
+
+def _raid() -> Raid:
+    raid = Raid(code="AbCd1234",
+                gym=Gym("Fountain", 45.5, 9.0),
+                is_ex=True,
+                level=5,
+                is_hatched=True,
+                end=datetime.time(18, 30, 15),
+                hatching=datetime.time(17, 45),
+                hangout=datetime.time(18, 10),
+                boss=Boss("Mewtwo", 5, True),
+                chat_id=-1001,
+                message_id=42)
+    raid.participants[7] = Participant(7, "Ash", Participant.Type.REMOTE, 2)
+    raid.participants[3] = Participant(3, "Misty")
+    return raid
+
+
+class TestCodec(unittest.TestCase):
+    def test_round_trip(self):
+        raid = _raid()
+
+        decoded = codec.decode(codec.encode(raid))
+
+        self.assertEqual(decoded, raid)
+        # The participants keep the order in which they joined
+        self.assertEqual(list(decoded.participants), [7, 3])
+
+    def test_defaults_omitted(self):
+        raid = Raid(code="AbCd1234")
+
+        fields = msgpack.unpackb(codec.encode(raid), strict_map_key=False)
+
+        self.assertEqual(fields, {codec.KEY_VERSION: codec.VERSION, codec.KEY_CODE: "AbCd1234"})
+        self.assertEqual(codec.decode(codec.encode(raid)), raid)
+
+    def test_arrays_edited_by_lua(self):
+        # cjson and cmsgpack turn an array with a nil into a map of 1-based indexes
+        fields = msgpack.unpackb(codec.encode(_raid()), strict_map_key=False)
+        fields[codec.KEY_GYM] = {1: "Fountain", 2: 45, 3: 9}
+        fields[codec.KEY_BOSS] = {1: "Mewtwo", 3: 1}
+
+        raid = codec.decode(msgpack.packb(fields))
+
+        self.assertEqual(raid.gym, Gym("Fountain", 45.0, 9.0))
+        self.assertIsInstance(raid.gym.latitude, float)
+        self.assertEqual(raid.boss, Boss("Mewtwo", None, True))
+
+    def test_participants_entries(self):
+        entries = {
+            b"7": codec.encode_participant_entry(Participant(7, "Ash", Participant.Type.FLYER), 2),
+            b"3": codec.encode_participant_entry(Participant(3, "Misty"), 1),
+            b"seq": b"2"
+        }
+
+        participants = codec.decode_participants(entries)
+
+        self.assertEqual(list(participants), [3, 7])
+        self.assertEqual(participants[7].type, Participant.Type.FLYER)
+
+    def test_invalid(self):
+        for data in (msgpack.packb({codec.KEY_VERSION: codec.VERSION + 1, codec.KEY_CODE: "AbCd1234"}),
+                     msgpack.packb({codec.KEY_CODE: "AbCd1234"}),
+                     msgpack.packb([1, 2]),
+                     b"\xc1"):
+            with self.subTest(data=data):
+                with self.assertRaises(codec.InvalidRaid):
+                    codec.decode(data)
+
+    def test_legacy(self):
+        self.assertTrue(codec.is_legacy(pickle.dumps({"code": "AbCd1234"})))
+        self.assertFalse(codec.is_legacy(codec.encode(_raid())))
+
+
+if __name__ == "__main__":
+    unittest.main()
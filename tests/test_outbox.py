@@ -0,0 +1,53 @@
+import unittest
+
+from pogoraidbot.outbox import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.bucket = TokenBucket(1, 3)
+        self.now = self.bucket._updated
+
+    def test_burst(self):
+        # A new bucket sends its capacity at once, then a request every 1 / rate seconds
+        for _ in range(3):
+            self.assertEqual(self.bucket.delay(self.now), 0)
+            self.bucket.take(self.now)
+
+        self.assertAlmostEqual(self.bucket.delay(self.now), 1)
+        self.assertAlmostEqual(self.bucket.delay(self.now + 0.25), 0.75)
+        self.assertEqual(self.bucket.delay(self.now + 1), 0)
+
+    def test_refill_capped(self):
+        for _ in range(3):
+            self.bucket.take(self.now)
+
+        self.assertFalse(self.bucket.is_full(self.now + 2))
+        self.assertTrue(self.bucket.is_full(self.now + 100))
+
+        # The idle time doesn't grant more than the capacity
+        for _ in range(3):
+            self.bucket.take(self.now + 100)
+        self.assertGreater(self.bucket.delay(self.now + 100), 0)
+
+    def test_past_time(self):
+        # A time read before the last refill doesn't take tokens away
+        self.bucket.take(self.now)
+        self.bucket.delay(self.now - 5)
+
+        self.assertEqual(self.bucket.delay(self.now), 0)
+        self.assertTrue(self.bucket.is_full(self.now + 1))
+
+    def test_block(self):
+        self.bucket.block(self.now, 10)
+
+        self.assertAlmostEqual(self.bucket.delay(self.now), 10)
+        self.assertFalse(self.bucket.is_full(self.now + 5))
+
+        # Once the block is over the tokens refilled meanwhile are available
+        self.assertEqual(self.bucket.delay(self.now + 10), 0)
+        self.assertTrue(self.bucket.is_full(self.now + 10))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from pogoraidbot.data.parser import JSONStream
+
+_DOCUMENT = '{"version": 12.5, "size": 1e+3, "gyms": [{"name": "A", "latitude": -45.25}, 7, -0.5e-2]}'
+
+
+def _chunks(document: str, size: int):
+    return iter([document[i:i + size] for i in range(0, len(document), size)])
+
+
+class TestJSONStream(unittest.TestCase):
+    def test_chunk_boundaries(self):
+        # Every chunk size splits the numbers at a different character
+        for size in range(1, len(_DOCUMENT) + 1):
+            with self.subTest(size=size):
+                stream = JSONStream(_chunks(_DOCUMENT, size))
+
+                document = {}
+                for key in stream.members():
+                    document[key] = list(stream.items()) if key == "gyms" else stream.value()
+
+                self.assertEqual(document, {
+                    "version": 12.5,
+                    "size": 1000.0,
+                    "gyms": [{"name": "A", "latitude": -45.25}, 7, -0.005]
+                })
+
+    def test_truncated(self):
+        stream = JSONStream(_chunks('{"version": 12.', 4))
+
+        with self.assertRaises(ValueError):
+            for _ in stream.members():
+                stream.value()
+
+
+if __name__ == "__main__":
+    unittest.main()
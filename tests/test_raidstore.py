@@ -0,0 +1,184 @@
+import datetime
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from redis import StrictRedis
+
+from pogoraidbot import redis_keys
+from pogoraidbot.data import Boss, Gym
+from pogoraidbot.raid import Participant, Raid
+from pogoraidbot.raidstore import RaidStore, RaidNotFound, END, REMIND, IN_PROGRESS_TIMEOUT
+
+# The scripts need the cmsgpack library of a real Redis server, the one shipped by redislite is used if it's installed
+try:
+    from redislite import __redis_executable__ as _REDIS_SERVER
+except ImportError:
+    _REDIS_SERVER = shutil.which("redis-server")
+
+_TOLERANCE = 120
+
+
+def _in(minutes: int) -> datetime.time:
+    return (datetime.datetime.now() + datetime.timedelta(minutes=minutes)).time().replace(microsecond=0)
+
+
+@unittest.skipIf(_REDIS_SERVER is None, "A Redis server isn't available")
+class TestRaidStore(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._folder = tempfile.mkdtemp()
+        socket = os.path.join(cls._folder, "redis.sock")
+        cls._server = subprocess.Popen([_REDIS_SERVER, "--port", "0", "--unixsocket", socket, "--save", "",
+                                        "--appendonly", "no"], stdout=subprocess.DEVNULL)
+
+        # Wait for the server
+        for _ in range(100):
+            if os.path.exists(socket):
+                break
+            time.sleep(0.05)
+
+        cls.redis = StrictRedis(unix_socket_path=socket)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.redis.connection_pool.disconnect()
+        cls._server.terminate()
+        cls._server.wait()
+        shutil.rmtree(cls._folder, ignore_errors=True)
+
+    def setUp(self):
+        self.redis.flushdb()
+        self.store = RaidStore(self.redis, 3600, 600, 900)
+
+    def _raid(self, **kwargs) -> Raid:
+        fields = {"gym": Gym("Fountain", 45.5, 9.0), "level": 5, "end": _in(30), "chat_id": -1001}
+        fields.update(kwargs)
+        return Raid(**fields)
+
+    def test_update_participant(self):
+        raid = self._raid()
+        self.store.save(raid)
+
+        self.assertTrue(self.store.update_participant(raid.code, 7, "Ash", "a")[0])
+        self.assertTrue(self.store.update_participant(raid.code, 3, "Misty", "a")[0])
+        self.assertTrue(self.store.update_participant(raid.code, 7, "Ash K.", "a")[0])
+        changed, updated = self.store.update_participant(raid.code, 3, "Misty", "h")
+
+        self.assertTrue(changed)
+        self.assertEqual(list(updated.participants.values()), [
+            Participant(7, "Ash K.", Participant.Type.NORMAL, 2),
+            Participant(3, "Misty", Participant.Type.REMOTE, 1)
+        ])
+
+        # Removing a participant that isn't there changes nothing
+        self.assertFalse(self.store.update_participant(raid.code, 9, "Brock", "r")[0])
+
+        _, updated = self.store.update_participant(raid.code, 3, "Misty", "r")
+        self.assertEqual(list(updated.participants), [7])
+
+        # The participants expire with the raid
+        self.assertGreater(self.redis.pttl(redis_keys.PARTICIPANTS.format(raid.code)), 0)
+
+        with self.assertRaises(RaidNotFound):
+            self.store.update_participant("AbCd1234", 7, "Ash", "a")
+
+    def test_set_fields(self):
+        raid = self._raid(is_aprx_time=True)
+        self.store.save(raid)
+        self.store.update_participant(raid.code, 7, "Ash", "a")
+        ttl = self.redis.pttl(redis_keys.RAID.format(raid.code))
+
+        updated = self.store.set_message(raid.code, 42)
+        self.assertEqual(updated.message_id, 42)
+        self.assertEqual(list(updated.participants), [7])
+        self.assertAlmostEqual(self.redis.pttl(redis_keys.RAID.format(raid.code)), ttl, delta=1000)
+
+        # Only the fields completed by the merge are written
+        merged = Raid(code=raid.code, boss=Boss("Mewtwo", 5, True), end=_in(40), chat_id=raid.chat_id)
+        updated = self.store.set_merged(merged)
+        self.assertEqual(updated.boss, Boss("Mewtwo", 5, True))
+        self.assertEqual(updated.end, merged.end)
+        self.assertFalse(updated.is_aprx_time)
+        self.assertEqual(updated.message_id, 42)
+        self.assertEqual(updated.gym, raid.gym)
+        self.assertEqual(self.store.get(raid.code), updated)
+
+        with self.assertRaises(RaidNotFound):
+            self.store.set_boss("AbCd1234", Boss("Mewtwo", 5, True))
+
+    def test_save_unique(self):
+        raid = self._raid()
+        self.assertIsNone(self.store.save_unique(raid, _TOLERANCE))
+
+        # The raid is saved, indexed and its post is claimed
+        self.assertEqual(self.store.get(raid.code), raid)
+        self.assertEqual([r.code for r in self.store.active(raid.chat_id)], [raid.code])
+        self.assertFalse(self.store.claim_post(raid.code))
+        self.store.release_post(raid.code)
+        self.assertTrue(self.store.claim_post(raid.code))
+
+        # The same gym at about the same time is a duplicate
+        duplicate = self._raid(end=(datetime.datetime.combine(datetime.date.today(), raid.end) +
+                                    datetime.timedelta(seconds=60)).time())
+        self.assertEqual(self.store.save_unique(duplicate, _TOLERANCE).code, raid.code)
+        with self.assertRaises(RaidNotFound):
+            self.store.get(duplicate.code)
+
+        # Another chat or another time isn't
+        self.assertIsNone(self.store.save_unique(self._raid(chat_id=-1002), _TOLERANCE))
+        self.assertIsNone(self.store.save_unique(self._raid(end=_in(50)), _TOLERANCE))
+
+    def test_save_unique_stale(self):
+        raid = self._raid()
+        self.store.save_unique(raid, _TOLERANCE)
+        self.redis.delete(redis_keys.RAID.format(raid.code))
+
+        # The index entry of a raid that is gone is removed and the raid is saved
+        other = self._raid()
+        self.assertIsNone(self.store.save_unique(other, _TOLERANCE))
+        self.assertEqual(self.store.get(other.code), other)
+        self.assertEqual([c.decode() for c in self.redis.zrange(self.store._gym_key(other), 0, -1)], [other.code])
+
+    def test_pop_due(self):
+        raids = [self._raid(end=_in(-1 - i)) for i in range(3)]
+        for raid in raids:
+            self.store.save(raid)
+        future = self._raid(end=_in(30), hangout=_in(20))
+        self.store.save(future)
+        self.store.update_participant(future.code, 7, "Ash", "a")
+        self.store.set_hangout(future.code, future.hangout)
+
+        # The earliest events are taken first
+        self.assertEqual(self.store.pop_due(2), [(END, raids[2].code), (END, raids[1].code)])
+        self.assertEqual(self.store.pop_due(2), [(END, raids[0].code)])
+        self.assertEqual(self.store.pop_due(2), [])
+        self.assertEqual(self.store.pending(), 2)
+
+        self.store.done(END, raids[2].code)
+        self.assertEqual(self.redis.zcard(redis_keys.SCHEDULE_IN_PROGRESS), 2)
+
+        # The events left in progress by a process that stopped are due again
+        with mock.patch("pogoraidbot.raidstore.time.time", return_value=time.time() + IN_PROGRESS_TIMEOUT + 1):
+            self.assertEqual(sorted(self.store.pop_due(10)),
+                             sorted([(END, raids[0].code), (END, raids[1].code), (REMIND, future.code)]))
+
+    def test_delete(self):
+        raid = self._raid(hangout=_in(20))
+        self.store.save(raid)
+        self.store.set_hangout(raid.code, raid.hangout)
+
+        self.store.delete(raid)
+
+        with self.assertRaises(RaidNotFound):
+            self.store.get(raid.code)
+        self.assertEqual(self.store.active(raid.chat_id), [])
+        self.assertEqual(self.store.pending(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()